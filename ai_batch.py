@@ -0,0 +1,265 @@
+"""
+Offline precomputation of AI analyses for high-scoring matches
+Builds the analysis prompt of every pair with LeadScore at or above a
+threshold exactly as the app does (ai_prompts), then completes them in
+bulk and stores the answers in the shared response cache, which
+get_ai_analysis consults before calling the API. The answers are pinned
+there, so the cache's TTL and LRU limit never evict them, however many
+pairs qualify.
+
+Two modes:
+- batch: the Message Batches API; prompts are submitted in chunks and the
+  job polls until each batch has ended
+- async: concurrent Messages API calls limited by a semaphore; --base-url
+  points it at another endpoint, e.g. a local stub in tests
+
+Per-item status (pending / submitted / done / failed) is recorded in a
+SQLite file keyed by the cache key, so an interrupted job resumes where it
+stopped: finished items are skipped and submitted batches are collected
+rather than resubmitted.
+
+Usage:
+    python ai_batch.py                                  # batch API, LeadScore >= 7
+    python ai_batch.py --mode async --concurrency 8 --base-url http://localhost:8080
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from anthropic import Anthropic, AsyncAnthropic
+
+from ai_cache import ResponseCache, cache_key
+from ai_prompts import AI_MODEL, ANALYSIS_MAX_TOKENS, analysis_prompt, completion_params, log_usage
+from match_dataset import load_dataset
+from match_store import read_bulk_match_details
+from playbook_index import PlaybookIndex
+
+logger = logging.getLogger(__name__)
+
+AI_BATCH_STATUS_PATH = 'data/ai_batch_status.sqlite'
+
+# Pairs at or above this LeadScore get a precomputed analysis
+BATCH_MIN_LEAD_SCORE = 7.0
+
+# Prompts per Message Batches request
+BATCH_CHUNK_SIZE = 10000
+
+# Seconds between checks on a submitted batch
+BATCH_POLL_SECONDS = 30
+
+# Concurrent requests in async mode
+ASYNC_CONCURRENCY = 8
+
+
+class BatchStatus:
+    """Per-item status of the precomputation job, stored in SQLite"""
+
+    def __init__(self, path=AI_BATCH_STATUS_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                " key TEXT PRIMARY KEY, biobank_name TEXT, post_title TEXT,"
+                " status TEXT NOT NULL, batch_id TEXT, error TEXT, updated REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Short-lived connection, committed and closed"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, items):
+        """Register (key, biobank_name, post_title) items not seen before as pending"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (key, biobank_name, post_title, status, updated)"
+                " VALUES (?, ?, ?, 'pending', ?)",
+                [(key, biobank_name, post_title, now) for key, biobank_name, post_title in items],
+            )
+
+    def mark(self, keys, status, batch_id=None, error=None):
+        """Set the status of items"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE items SET status = ?, batch_id = COALESCE(?, batch_id), error = ?, updated = ?"
+                " WHERE key = ?",
+                [(status, batch_id, error, now, key) for key in keys],
+            )
+
+    def statuses(self, keys):
+        """Current status of each key"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT key, status FROM items").fetchall()
+        wanted = set(keys)
+        return {key: status for key, status in rows if key in wanted}
+
+    def open_batches(self):
+        """Batch ids that still have submitted items"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT DISTINCT batch_id FROM items WHERE status = 'submitted'").fetchall()
+        return [row[0] for row in rows if row[0]]
+
+    def counts(self):
+        """Number of items per status"""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+
+
+def build_prompts(min_lead_score=BATCH_MIN_LEAD_SCORE, limit=None):
+    """cache key -> (biobank_name, post_title, prompt) for every qualifying pair"""
+    dataset = load_dataset()
+    frame = dataset.frame
+    positions = np.flatnonzero(frame['LeadScore'].to_numpy(dtype=float) >= min_lead_score)
+    if limit:
+        positions = positions[:limit]
+    details = read_bulk_match_details(min_lead_score)
+    playbook = PlaybookIndex.from_file()
+    params = completion_params(ANALYSIS_MAX_TOKENS)
+
+    # Rows come from the same view table as the app's, so prompts match byte for byte
+    prompts = {}
+    for _, match in frame.iloc[positions].iterrows():
+        biobank_name, request_title = match['biobank_name'], match['post_title']
+        prompt = analysis_prompt(
+            match, details.get((biobank_name, request_title)), biobank_name, request_title, playbook
+        )
+        prompts[cache_key(AI_MODEL, params, prompt)] = (biobank_name, request_title, prompt)
+    return prompts
+
+
+def _message_params(prompt):
+    """Messages API parameters of one analysis"""
+    return {
+        'model': AI_MODEL,
+        'messages': [{"role": "user", "content": prompt}],
+        **completion_params(ANALYSIS_MAX_TOKENS),
+    }
+
+
+def collect_batch(client, batch_id, status, cache, prompts, poll_seconds=BATCH_POLL_SECONDS):
+    """Wait for a batch to end and store its results"""
+    while True:
+        batch = client.messages.batches.retrieve(batch_id)
+        if batch.processing_status == 'ended':
+            break
+        logger.info("Batch %s: %s", batch_id, batch.request_counts)
+        time.sleep(poll_seconds)
+
+    done, failed, input_tokens = 0, 0, 0
+    for entry in client.messages.batches.results(batch_id):
+        if entry.result.type == 'succeeded':
+            message = entry.result.message
+            # Prompts of a resumed job's earlier run may no longer be built
+            if entry.custom_id in prompts:
+                log_usage("AI batch item", message.usage, prompts[entry.custom_id][2], logging.DEBUG)
+            input_tokens += message.usage.input_tokens
+            cache.put(entry.custom_id, message.content[0].text, pinned=True)
+            status.mark([entry.custom_id], 'done')
+            done += 1
+        else:
+            status.mark([entry.custom_id], 'failed', error=entry.result.type)
+            failed += 1
+    logger.info("Batch %s ended: %d done, %d failed, %d input tokens", batch_id, done, failed, input_tokens)
+
+
+def run_batches(client, prompts, pending, status, cache, chunk_size=BATCH_CHUNK_SIZE,
+                poll_seconds=BATCH_POLL_SECONDS):
+    """Submit pending prompts through the Message Batches API and collect every open batch"""
+    for start in range(0, len(pending), chunk_size):
+        keys = pending[start:start + chunk_size]
+        # The cache key is a 64-character hex digest, a valid custom_id
+        batch = client.messages.batches.create(requests=[
+            {'custom_id': key, 'params': _message_params(prompts[key][2])}
+            for key in keys
+        ])
+        status.mark(keys, 'submitted', batch_id=batch.id)
+        logger.info("Submitted batch %s with %d prompts", batch.id, len(keys))
+
+    for batch_id in status.open_batches():
+        collect_batch(client, batch_id, status, cache, prompts, poll_seconds)
+
+
+async def run_async(client, prompts, pending, status, cache, concurrency=ASYNC_CONCURRENCY):
+    """Complete pending prompts with at most concurrency requests in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    input_tokens = []
+
+    async def complete(key):
+        async with semaphore:
+            try:
+                response = await client.messages.create(**_message_params(prompts[key][2]))
+            except Exception as e:
+                status.mark([key], 'failed', error=str(e))
+                return
+        log_usage("AI batch item", response.usage, prompts[key][2], logging.DEBUG)
+        input_tokens.append(response.usage.input_tokens)
+        cache.put(key, response.content[0].text, pinned=True)
+        status.mark([key], 'done')
+
+    await asyncio.gather(*(complete(key) for key in pending))
+    logger.info("Completed %d prompts, %d input tokens", len(input_tokens), sum(input_tokens))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute AI analyses for high-scoring matches")
+    parser.add_argument('--min-score', type=float, default=BATCH_MIN_LEAD_SCORE, help="Minimum LeadScore")
+    parser.add_argument('--mode', choices=['batch', 'async'], default='batch')
+    parser.add_argument('--concurrency', type=int, default=ASYNC_CONCURRENCY, help="Requests in flight (async)")
+    parser.add_argument('--base-url', default=None, help="API endpoint override (async), e.g. a local stub")
+    parser.add_argument('--poll-seconds', type=float, default=BATCH_POLL_SECONDS, help="Batch status poll interval")
+    parser.add_argument('--limit', type=int, default=None, help="Only the first N qualifying pairs")
+    parser.add_argument('--retry-failed', action='store_true', help="Resubmit items that failed before")
+    parser.add_argument('--status', default=AI_BATCH_STATUS_PATH, help="Status database path")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    prompts = build_prompts(args.min_score, args.limit)
+    status = BatchStatus(args.status)
+    cache = ResponseCache()
+    status.add([(key, biobank_name, title) for key, (biobank_name, title, _) in prompts.items()])
+
+    # Anything already answered (e.g. clicked in the app) needs no call and
+    # is pinned so it stays; done items missing from the cache (e.g. a
+    # deleted cache file) are due again
+    current = status.statuses(prompts)
+    pending = []
+    for key, item_status in current.items():
+        cached = cache.get(key)
+        if cached is not None:
+            cache.put(key, cached, pinned=True)
+            if item_status != 'done':
+                status.mark([key], 'done')
+        elif item_status == 'submitted' and args.mode == 'batch':
+            continue
+        elif item_status != 'failed' or args.retry_failed:
+            pending.append(key)
+    logger.info("%d qualifying pairs, %d to complete", len(prompts), len(pending))
+
+    api_key = os.environ.get("ANTHROPIC_API_KEY") or ("stub" if args.base_url else None)
+    if args.mode == 'batch':
+        run_batches(Anthropic(api_key=api_key), prompts, pending, status, cache, poll_seconds=args.poll_seconds)
+    else:
+        client = AsyncAnthropic(api_key=api_key, base_url=args.base_url)
+        asyncio.run(run_async(client, prompts, pending, status, cache, args.concurrency))
+
+    print(f"Status: {status.counts()}")
+
+
+if __name__ == "__main__":
+    main()
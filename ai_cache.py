@@ -0,0 +1,110 @@
+"""
+Persistent AI response cache for the Biobank Viewer
+Completed responses are stored in a SQLite file shared by every session
+and worker process, keyed by a SHA-256 hash of the model, the request
+parameters and the prompt text. Entries expire after a TTL and the least
+recently used ones are evicted once the cache holds more than max_entries.
+Pinned entries, the offline job's precomputed analyses (ai_batch.py), are
+exempt from both and do not count towards max_entries.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+AI_CACHE_PATH = 'data/ai_cache.sqlite'
+
+# Cached analyses are reused for a week
+AI_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Least recently used entries beyond this are evicted
+AI_CACHE_MAX_ENTRIES = 5000
+
+
+def cache_key(model, params, prompt):
+    """Stable hash of everything that determines a completion"""
+    payload = json.dumps({'model': model, 'params': params, 'prompt': prompt}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed key -> response text store with TTL and LRU eviction"""
+
+    def __init__(self, path=AI_CACHE_PATH, ttl_seconds=AI_CACHE_TTL_SECONDS, max_entries=AI_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets readers in other processes proceed while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL, pinned INTEGER NOT NULL DEFAULT 0)"
+            )
+            # Caches created before pinning existed gain the column
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(responses)")]
+            if 'pinned' not in columns:
+                conn.execute("ALTER TABLE responses ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @contextmanager
+    def _connect(self):
+        """Short-lived connection, committed and closed; safe from any thread or process"""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """Cached response text, or None if missing or expired"""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT response FROM responses WHERE key = ? AND (pinned = 1 OR created >= ?)",
+                    (key, now - self.ttl_seconds),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            logger.exception("AI cache read failed")
+            return None
+        return row[0] if row else None
+
+    def put(self, key, response, pinned=False):
+        """Store a response, then drop expired and least recently used unpinned entries"""
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                # A pinned entry stays pinned when the same key is stored again
+                conn.execute(
+                    "INSERT INTO responses (key, response, created, accessed, pinned) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (key) DO UPDATE SET response = excluded.response, created = excluded.created,"
+                    " accessed = excluded.accessed, pinned = MAX(pinned, excluded.pinned)",
+                    (key, response, now, now, int(pinned)),
+                )
+                conn.execute("DELETE FROM responses WHERE pinned = 0 AND created < ?", (now - self.ttl_seconds,))
+                conn.execute(
+                    "DELETE FROM responses WHERE pinned = 0 AND key NOT IN"
+                    " (SELECT key FROM responses WHERE pinned = 0 ORDER BY accessed DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error:
+            logger.exception("AI cache write failed")
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
@@ -0,0 +1,128 @@
+"""
+Process-wide Anthropic clients for the Biobank Viewer
+One client, and so one HTTP connection pool, is shared by every session
+and the background prefetcher instead of one per browser session. The
+pool keeps a bounded number of warm keep-alive connections and closes
+idle ones, and requests time out instead of hanging a script run. The
+async client used by the executor (ai_executor.py) gets a pool with the
+same limits. One InFlightLimit caps how many requests the process has in
+flight at once across both: the prefetcher's calls and the executor's
+streams hold slots of the same semaphore. SDK retries are off: ai_limits
+retries with jitter and feeds a circuit breaker instead.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+from anthropic import Anthropic, AsyncAnthropic, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+logger = logging.getLogger(__name__)
+
+# Connection pool: total connections and warm connections kept for reuse
+AI_MAX_CONNECTIONS = 20
+AI_MAX_KEEPALIVE_CONNECTIONS = 10
+
+# Idle connections are closed after this many seconds
+AI_KEEPALIVE_EXPIRY = 60.0
+
+# Seconds to connect, and to wait for a response (or the next streamed chunk)
+AI_CONNECT_TIMEOUT = 5.0
+AI_READ_TIMEOUT = 60.0
+
+# Requests in flight per process, and how long a request waits for a slot
+AI_MAX_IN_FLIGHT = 8
+AI_SLOT_WAIT_SECONDS = 30.0
+
+# How often a request on the event loop checks for a free slot
+SLOT_POLL_SECONDS = 0.05
+
+
+def _pool_settings():
+    """httpx limits and timeouts shared by the sync and async clients"""
+    return {
+        'limits': httpx.Limits(
+            max_connections=AI_MAX_CONNECTIONS,
+            max_keepalive_connections=AI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=AI_KEEPALIVE_EXPIRY,
+        ),
+        'timeout': httpx.Timeout(AI_READ_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+    }
+
+
+def build_client(api_key, base_url=None):
+    """Anthropic client with a bounded keep-alive pool and timeouts"""
+    return Anthropic(
+        api_key=api_key, base_url=base_url, max_retries=0, http_client=DefaultHttpxClient(**_pool_settings())
+    )
+
+
+def build_async_client(api_key, base_url=None):
+    """AsyncAnthropic client with the same pool limits and timeouts"""
+    return AsyncAnthropic(
+        api_key=api_key, base_url=base_url, max_retries=0, http_client=DefaultAsyncHttpxClient(**_pool_settings())
+    )
+
+
+class InFlightLimit:
+    """Process-wide cap on AI requests in flight, usable from threads and the event loop"""
+
+    def __init__(self, max_in_flight=AI_MAX_IN_FLIGHT, slot_wait_seconds=AI_SLOT_WAIT_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.slot_wait_seconds = slot_wait_seconds
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+
+    def _timeout(self):
+        return TimeoutError(f"More than {self.max_in_flight} AI requests in flight")
+
+    @contextmanager
+    def slot(self):
+        """Hold one slot for the duration of a blocking request"""
+        if not self._slots.acquire(timeout=self.slot_wait_seconds):
+            raise self._timeout()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Hold one slot for the duration of a request on an event loop"""
+        # Polled so that waiting never blocks the loop or ties up a thread
+        deadline = time.monotonic() + self.slot_wait_seconds
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                raise self._timeout()
+            await asyncio.sleep(SLOT_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+class BoundedClient:
+    """Anthropic client whose messages.create holds a slot of an InFlightLimit"""
+
+    def __init__(self, client, limit):
+        self.client = client
+        self.limit = limit
+        self.messages = _BoundedMessages(self)
+
+
+class _BoundedMessages:
+    """messages resource of a BoundedClient"""
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        with self._owner.limit.slot():
+            return self._owner.client.messages.create(**kwargs)
+
+
+def shared_client(api_key, limit, base_url=None):
+    """Pooled client for one process whose calls count against limit"""
+    return BoundedClient(build_client(api_key, base_url), limit)
@@ -0,0 +1,187 @@
+"""
+Background executor for AI analyses and follow-up answers
+Completions run on an asyncio event loop in a dedicated thread per
+process, so a slow answer never blocks a Streamlit script run. submit()
+returns an AnalysisJob handle at once; the page keeps the handle in
+session state and renders its text, partial while the answer streams in
+and complete once it is done, on later reruns.
+
+Identical prompts submitted while one is running share its job, cached
+answers complete immediately, and finished answers are written to the
+shared response cache. Calls go through the process's UpstreamGuard
+(ai_limits); when the upstream is unhealthy a job completes with the
+caller's degraded fallback text instead of an error. stats() reports
+queue depth and recent latency.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from ai_limits import CircuitOpenError, is_retryable
+from ai_prompts import count_tokens, log_usage
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept for the latency percentiles
+LATENCY_WINDOW = 200
+
+# How long a job waits for a running prefetch of the same prompt
+PREFETCH_WAIT_SECONDS = 30
+
+
+class AnalysisJob:
+    """Handle of one submitted completion, filled in by the executor thread"""
+
+    def __init__(self, key):
+        self.key = key
+        self.text = ""
+        self.error = None
+        self.degraded = False
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+
+    @classmethod
+    def completed(cls, key, text, degraded=False):
+        """A job that is already done, e.g. answered from the cache"""
+        job = cls(key)
+        job.text = text
+        job.degraded = degraded
+        job.started = job.finished = job.submitted
+        return job
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+
+class AsyncExecutor:
+    """Runs completions on a private event loop and hands back pollable jobs"""
+
+    def __init__(self, client, cache, model, guard, limit):
+        self.client = client
+        self.cache = cache
+        self.model = model
+        self.guard = guard
+        self.limit = limit
+
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._finished = deque(maxlen=LATENCY_WINDOW)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="ai-executor", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, prompt, params, wait_for=None, wait_seconds=PREFETCH_WAIT_SECONDS, fallback=None):
+        """Start a completion and return its job without waiting for it"""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                return job
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            return AnalysisJob.completed(key, cached)
+
+        # Fail fast while the upstream is known to be unhealthy
+        if fallback is not None and self.guard.breaker.is_open():
+            return AnalysisJob.completed(key, fallback, degraded=True)
+
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                return job
+            job = self._jobs[key] = AnalysisJob(key)
+        asyncio.run_coroutine_threadsafe(self._run(job, prompt, params, wait_for, wait_seconds, fallback), self._loop)
+        return job
+
+    async def _stream(self, job, prompt, params):
+        """One attempt: stream the completion into the job"""
+        job.text = ""
+        async with self.client.messages.stream(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            **params
+        ) as stream:
+            async for text in stream.text_stream:
+                job.text += text
+            message = await stream.get_final_message()
+        log_usage("AI job", message.usage, prompt)
+
+    async def _run(self, job, prompt, params, wait_for, wait_seconds, fallback):
+        """Loop thread: stream one completion into its job"""
+        try:
+            if wait_for is not None:
+                # A concurrent.futures.Future from the prefetcher; shielded so
+                # giving up on it does not cancel the prefetch itself
+                try:
+                    await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(wait_for)), wait_seconds)
+                except asyncio.CancelledError:
+                    # A cancelled prefetch only means this job calls the API
+                    # itself; cancellation of the job's own task propagates
+                    if not wait_for.cancelled():
+                        raise
+                except Exception:
+                    pass
+                cached = await asyncio.to_thread(self.cache.get, job.key)
+                if cached is not None:
+                    job.text = cached
+                    return
+
+            # Jobs queue for the process-wide in-flight slots shared with the prefetcher
+            async with self.limit.aslot():
+                job.started = time.monotonic()
+                # Rate limited, retried on 429/5xx; a retry restarts the text
+                await self.guard.acall(
+                    lambda: self._stream(job, prompt, params),
+                    count_tokens(prompt) + params['max_tokens'],
+                )
+
+            # Only complete answers are cached; a failed stream is dropped
+            await asyncio.to_thread(self.cache.put, job.key, job.text)
+        except Exception as e:
+            if isinstance(e, CircuitOpenError) or is_retryable(e):
+                logger.warning("AI upstream unavailable: %s", e)
+                if fallback is not None:
+                    job.text = fallback
+                    job.degraded = True
+                else:
+                    job.error = str(e)
+            else:
+                logger.exception("AI job failed")
+                job.error = str(e)
+        finally:
+            if job.started is None:
+                job.started = time.monotonic()
+            job.finished = time.monotonic()
+            with self._lock:
+                self._jobs.pop(job.key, None)
+                self._finished.append((job.started - job.submitted, job.finished - job.submitted))
+
+    def stats(self):
+        """Queue depth and recent latency (seconds) of the executor"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+            finished = list(self._finished)
+        waits = sorted(wait for wait, _ in finished)
+        totals = sorted(total for _, total in finished)
+
+        def percentile(values, q):
+            return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+        return {
+            'queued': sum(1 for job in jobs if job.started is None),
+            'running': sum(1 for job in jobs if job.started is not None),
+            'wait_p50': percentile(waits, 0.5),
+            'latency_p50': percentile(totals, 0.5),
+            'latency_p95': percentile(totals, 0.95),
+        }
+
+    def close(self):
+        """Stop the event loop thread"""
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
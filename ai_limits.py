@@ -0,0 +1,206 @@
+"""
+Client-side protection of the upstream AI API
+One UpstreamGuard per process is shared by every session, the executor
+and the prefetcher:
+- a token-bucket limiter paces requests to configured requests-per-minute
+  and tokens-per-minute budgets (AI_REQUESTS_PER_MINUTE and
+  AI_TOKENS_PER_MINUTE environment variables override the defaults)
+- 429, 5xx/overloaded, timeout and connection errors are retried with
+  exponential backoff and full jitter, honouring retry-after
+- a circuit breaker opens after consecutive failures; while it is open,
+  calls fail fast with CircuitOpenError so callers can answer from the
+  cache or with a degraded answer, and after a cool-down a single trial
+  call decides whether it closes again
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+import anthropic
+
+logger = logging.getLogger(__name__)
+
+AI_REQUESTS_PER_MINUTE = int(os.environ.get("AI_REQUESTS_PER_MINUTE", 50))
+AI_TOKENS_PER_MINUTE = int(os.environ.get("AI_TOKENS_PER_MINUTE", 50000))
+
+# Retries after the first attempt, and the backoff bounds in seconds
+AI_RETRY_ATTEMPTS = 3
+AI_RETRY_BASE_SECONDS = 1.0
+AI_RETRY_MAX_SECONDS = 20.0
+
+# Consecutive failures that open the circuit, and its cool-down in seconds
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 60.0
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open"""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """Take amount now, going into debt if needed; seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Oversized requests cost at most a full bucket so they still run
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets"""
+
+    def __init__(self, requests_per_minute=AI_REQUESTS_PER_MINUTE, tokens_per_minute=AI_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def reserve(self, tokens):
+        """Seconds to wait before a request of about this many tokens may start"""
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens))
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial after a cool-down"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Whether calls are currently refused (no state change)"""
+        with self._lock:
+            if self._opened is None:
+                return False
+            return self._trial or time.monotonic() - self._opened < self.reset_seconds
+
+    def retry_in(self):
+        """Seconds until the next trial call is allowed"""
+        with self._lock:
+            if self._opened is None:
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self._opened))
+
+    def allow(self):
+        """Whether a call may go ahead; after the cool-down one trial call is let through"""
+        with self._lock:
+            if self._opened is None:
+                return True
+            if self._trial or time.monotonic() - self._opened < self.reset_seconds:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened is not None:
+                logger.info("AI circuit closed")
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened is None and self._failures >= self.failure_threshold):
+                logger.warning("AI circuit open after %d failures", self._failures)
+                self._opened = time.monotonic()
+            self._trial = False
+
+
+def is_retryable(error):
+    """Rate limits, server errors, timeouts and dropped connections"""
+    if isinstance(error, (anthropic.RateLimitError, anthropic.APIConnectionError)):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def backoff_seconds(attempt, error=None):
+    """Full-jitter exponential backoff, at least the server's retry-after"""
+    delay = random.uniform(0, min(AI_RETRY_MAX_SECONDS, AI_RETRY_BASE_SECONDS * 2 ** attempt))
+    response = getattr(error, 'response', None)
+    if response is not None:
+        try:
+            delay = max(delay, float(response.headers.get('retry-after', 0)))
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+
+class UpstreamGuard:
+    """Rate limiter, retries and circuit breaker around API calls"""
+
+    def __init__(self, limiter=None, breaker=None, retries=AI_RETRY_ATTEMPTS):
+        self.limiter = limiter or RateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = retries
+
+    def _attempts(self):
+        """Yield attempt numbers while the circuit lets calls through"""
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"AI service unavailable, retry in {self.breaker.retry_in():.0f}s")
+            yield attempt
+
+    def _failed(self, attempt, error):
+        """Record a failed attempt; the backoff before the next one, or None to give up"""
+        if not is_retryable(error):
+            # e.g. a 400: the upstream answered, so it counts as healthy
+            self.breaker.record_success()
+            return None
+        self.breaker.record_failure()
+        if attempt == self.retries:
+            return None
+        delay = backoff_seconds(attempt, error)
+        logger.info("AI call failed (%s), retry %d in %.1fs", error, attempt + 1, delay)
+        return delay
+
+    def call(self, func, tokens):
+        """Run func() under the limits, retrying retryable errors"""
+        for attempt in self._attempts():
+            time.sleep(self.limiter.reserve(tokens))
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._failed(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, func, tokens):
+        """Await func() under the limits, retrying retryable errors"""
+        for attempt in self._attempts():
+            await asyncio.sleep(self.limiter.reserve(tokens))
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._failed(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
@@ -0,0 +1,126 @@
+"""
+Background prefetch of AI analyses for the Biobank Viewer
+When a user selects a request, analyses for its top matches are started
+on a small thread pool. Finished analyses land in the shared response
+cache, so the "Get AI Analysis" button usually answers from there; a
+press while a prefetch is still running hands its future to the
+executor, which waits for it instead of paying for a second call.
+Prompts are built on the script thread and handed in, so workers never
+touch Streamlit state.
+
+Prefetches are grouped per session and the queued ones are cancelled
+when the session moves to another request, leaves the request view or
+turns prefetching off. A rolling hourly budget caps how many API calls
+prefetching may spend per process, and calls share the process's rate
+limits and circuit breaker (ai_limits); nothing is prefetched while the
+circuit is open.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ai_prompts import count_tokens, log_usage
+
+logger = logging.getLogger(__name__)
+
+# Concurrent prefetch calls per process
+PREFETCH_WORKERS = 2
+
+# Prefetch API calls allowed per process in any rolling hour
+PREFETCH_HOURLY_BUDGET = 200
+
+
+class AnalysisPrefetcher:
+    """Process-wide pool that completes prompts ahead of time into a response cache"""
+
+    def __init__(self, client, cache, model, guard, workers=PREFETCH_WORKERS, hourly_budget=PREFETCH_HOURLY_BUDGET):
+        self.client = client
+        self.cache = cache
+        self.model = model
+        self.guard = guard
+        self.hourly_budget = hourly_budget
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-prefetch")
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._groups = {}
+        self._calls = deque()
+
+    def _spend(self):
+        """Take one call from the hourly budget; False when it is used up"""
+        now = time.monotonic()
+        while self._calls and now - self._calls[0] > 3600:
+            self._calls.popleft()
+        if len(self._calls) >= self.hourly_budget:
+            return False
+        self._calls.append(now)
+        return True
+
+    def _complete(self, key, prompt, params):
+        """Worker: call the Messages API and store the answer in the cache"""
+        try:
+            response = self.guard.call(
+                lambda: self.client.messages.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    **params
+                ),
+                count_tokens(prompt) + params['max_tokens'],
+            )
+            log_usage("AI prefetch", response.usage, prompt)
+            text = response.content[0].text
+            self.cache.put(key, text)
+            return text
+        except Exception:
+            logger.exception("AI prefetch failed")
+            return None
+        finally:
+            with self._lock:
+                self._futures.pop(key, None)
+
+    def submit(self, group, key, prompt, params):
+        """Start completing a prompt unless it is cached, running or over budget"""
+        with self._lock:
+            if key in self._futures:
+                return False
+            if self.cache.get(key) is not None:
+                return False
+            if self.guard.breaker.is_open():
+                return False
+            if not self._spend():
+                logger.info("AI prefetch budget of %d calls/hour used up", self.hourly_budget)
+                return False
+            future = self._pool.submit(self._complete, key, prompt, params)
+            self._futures[key] = future
+            entries = [(k, f) for k, f in self._groups.get(group, []) if not f.done()]
+            self._groups[group] = entries + [(key, future)]
+            return True
+
+    def cancel(self, group):
+        """Cancel a group's prefetches that have not started yet"""
+        cancelled = 0
+        with self._lock:
+            for key, future in self._groups.pop(group, []):
+                # A cancelled future never runs: drop its key and refund its budget
+                if future.cancel():
+                    cancelled += 1
+                    if self._futures.get(key) is future:
+                        del self._futures[key]
+                    if self._calls:
+                        self._calls.pop()
+        if cancelled:
+            logger.info("Cancelled %d queued AI prefetches", cancelled)
+        return cancelled
+
+    def future(self, key):
+        """Future of a queued or running prefetch of this prompt, or None"""
+        with self._lock:
+            return self._futures.get(key)
+
+    def pending(self):
+        """Number of prefetches queued or running"""
+        with self._lock:
+            return len(self._futures)
@@ -0,0 +1,262 @@
+"""
+Prompt construction and model settings for AI analyses
+Shared by the Streamlit app and the offline batch job (ai_batch.py) so
+both produce byte-identical prompts, and therefore the same response
+cache keys, for the same match. Prompts are assembled within a token
+budget counted locally: the request's and biobank's free text and the
+playbook context each get a budget and are trimmed in reverse priority
+order when the whole prompt would run over.
+"""
+
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_BASE_PATH = 'config/knowledge/Playbook_ALL.md'
+
+# Use Claude Haiku for cost efficiency (~$0.001 per analysis)
+AI_MODEL = "claude-3-haiku-20240307"
+AI_TEMPERATURE = 0.7
+ANALYSIS_MAX_TOKENS = 500
+FOLLOWUP_MAX_TOKENS = 300
+
+# Input tokens (local estimate) an analysis prompt may use
+PROMPT_TOKEN_BUDGET = 2000
+
+# Trimmable prompt sections in priority order with their own token budgets;
+# the match facts, compatibility checks and instructions are never trimmed
+KNOWLEDGE_TOKEN_BUDGET = 750
+PROMPT_SECTIONS = [
+    ('request_context', 300),
+    ('biobank_context', 300),
+    ('knowledge', KNOWLEDGE_TOKEN_BUDGET),
+]
+
+
+def completion_params(max_tokens):
+    """Request parameters that, with the model and prompt, key the response cache"""
+    return {'max_tokens': max_tokens, 'temperature': AI_TEMPERATURE}
+
+
+def read_knowledge_base(path=KNOWLEDGE_BASE_PATH):
+    """Biobanking playbook text, or an empty string if it is missing"""
+    if not os.path.exists(path):
+        return ""
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def count_tokens(text):
+    """Local estimate of a text's token count (no API call)"""
+    # Words of up to four characters and punctuation marks are about one
+    # token each, longer words one per four characters
+    return sum((len(piece) + 3) // 4 for piece in re.findall(r'\w+|[^\w\s]', text))
+
+
+def truncate_tokens(text, max_tokens):
+    """Text cut at a word boundary to at most max_tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    used = 0
+    end = 0
+    for piece in re.finditer(r'\w+|[^\w\s]', text):
+        used += (len(piece.group()) + 3) // 4
+        # One token is kept for the ellipsis
+        if used > max_tokens - 1:
+            break
+        end = piece.end()
+    return text[:end].rstrip() + "…" if end else ""
+
+
+def _present(value):
+    """Whether a free-text field has content (missing values arrive as None or NaN)"""
+    if value is None or (isinstance(value, float) and value != value):
+        return False
+    return str(value).strip() != ''
+
+
+def fit_fields(fields, max_tokens):
+    """'Label: value' lines within a token budget; the longest values are shortened first"""
+    fields = [(label, str(value).strip()) for label, value in fields if _present(value)]
+    lines = {}
+    remaining = max_tokens
+    # Short fields are kept whole and what they leave is shared by the rest
+    order = sorted(range(len(fields)), key=lambda i: count_tokens(fields[i][1]))
+    for n, i in enumerate(order):
+        label, value = fields[i]
+        share = remaining // (len(order) - n)
+        line = truncate_tokens(f"{label}: {value}", share)
+        if line:
+            lines[i] = line
+            remaining -= count_tokens(line)
+    return "\n".join(lines[i] for i in sorted(lines))
+
+
+def log_usage(source, usage, prompt, level=logging.INFO):
+    """Log a call's billed input tokens next to the local estimate of its prompt"""
+    logger.log(
+        level, "%s: %d input tokens (estimated %d), %d output tokens",
+        source, usage.input_tokens, count_tokens(prompt), usage.output_tokens,
+    )
+
+
+def generate_ai_prompt(match, biobank_name, request_title, knowledge_base, token_budget=PROMPT_TOKEN_BUDGET):
+    """Generate comprehensive prompt for AI analysis within a token budget"""
+    
+    # Extract match details
+    disease_score = match.get('s_disease', 0)
+    type_score = match.get('s_sample_type', 0) 
+    format_score = match.get('s_sample_format', 0)
+    lead_score = match.get('LeadScore', 0)
+    
+    # Request context
+    r_disease = match.get('r_disease', 'Not specified')
+    r_sample_type = match.get('r_sample_type', 'Not specified')
+    r_sample_format = match.get('r_sample_format', 'Not specified')
+    r_country = match.get('r_country', 'Not specified')
+    r_collaboration = match.get('r_collaboration', 'Not specified')
+    r_prospective = match.get('r_prospective', 'Not specified')
+    
+    # Additional request context if available
+    request_fields = [
+        ('Project Overview', match.get('r_post_content', '')),
+        ('Study Scale', match.get('r_no_cases', '')),
+        ('Data Requirements', match.get('r_data_required', '')),
+        ('Inclusion Criteria', match.get('r_inclusion_criteria', '')),
+        ('Exclusion Criteria', match.get('r_exclusion_criteria', '')),
+    ]
+    
+    # Biobank context
+    b_disease = match.get('b_disease', 'Not specified')
+    b_sample_type = match.get('b_sample_type', 'Not specified')
+    b_sample_format = match.get('b_sample_format', 'Not specified')
+    b_country = match.get('b_country', 'Not specified')
+    b_collaboration = match.get('b_collaboration', 'Not specified')
+    b_prospective = match.get('b_prospective', 'Not specified')
+    biobank_specialty = match.get('biobank_specialty', 'Not specified')
+    
+    # Additional biobank context if available
+    biobank_fields = [
+        ('Description', match.get('b_post_content', '')),
+        ('Clinical Data', match.get('b_clinical_information', '')),
+        ('Services', match.get('b_research_services', '')),
+        ('Certifications', match.get('b_certifications', '')),
+    ]
+    
+    # Each trimmable section renders itself within a token budget
+    renderers = {
+        'request_context': lambda budget: fit_fields(request_fields, budget),
+        'biobank_context': lambda budget: fit_fields(biobank_fields, budget),
+        'knowledge': knowledge_base if callable(knowledge_base) else (
+            lambda budget: truncate_tokens(knowledge_base, budget)
+        ),
+    }
+    
+    def render(knowledge="", request_context="", biobank_context=""):
+        return f"""You are a biobank partnership specialist analyzing compatibility between a research request and a biobank.
+Use the provided knowledge base to give specific, actionable guidance.
+
+## KNOWLEDGE BASE CONTEXT
+{knowledge}
+
+## MATCH OVERVIEW
+Biobank: {biobank_name}
+Research Request: {request_title}
+LeadScore: {lead_score:.1f}/10
+- Disease Match: {disease_score:.1f}/6
+- Sample Type Match: {type_score:.1f}/2
+- Sample Format Match: {format_score:.1f}/2
+
+## REQUEST DETAILS
+Disease Focus: {r_disease}
+Sample Types Needed: {r_sample_type}
+Sample Format: {r_sample_format}
+Location: {r_country}
+**Collaboration Terms Preference: {r_collaboration}**
+**Prospective Collection Required: {r_prospective}**
+
+Additional Context:
+{request_context}
+
+## BIOBANK DETAILS
+Specialty: {biobank_specialty}
+Disease Focus: {b_disease}
+Sample Types Available: {b_sample_type}
+Sample Formats: {b_sample_format}
+Location: {b_country}
+**Collaboration Terms Requirement: {b_collaboration}**
+**Prospective Collection Capability: {b_prospective}**
+
+Additional Context:
+{biobank_context}
+
+## CRITICAL COMPATIBILITY CHECKS
+
+### COLLABORATION TERMS:
+Request prefers: {r_collaboration}
+Biobank requires: {b_collaboration}
+**IMPORTANT:** If biobank requires "Yes" (mandatory collaboration) but request prefers "fee-for-service", these are INCOMPATIBLE and will require negotiation.
+
+### PROSPECTIVE COLLECTION:
+Request needs: {r_prospective}
+Biobank offers: {b_prospective}
+**IMPORTANT:** If request requires prospective collection ("Yes") but biobank cannot provide it ("No"), this is a MAJOR INCOMPATIBILITY.
+
+## ANALYSIS REQUEST
+Provide a concise partnership assessment covering:
+
+1. **Collaboration Compatibility**: Are the collaboration terms aligned? Flag any conflicts.
+2. **Prospective Collection Match**: Can the biobank meet prospective collection needs if required?
+3. **Match Strengths**: What makes this a good/poor match overall?
+4. **Regulatory Considerations**: Key requirements based on jurisdictions
+5. **Next Steps**: Specific actions, especially addressing any term conflicts
+6. **Potential Deal-Breakers**: Highlight any critical incompatibilities
+
+Keep response under 300 words. Be specific about collaboration and prospective collection issues."""
+    
+    # Match facts, checks and instructions are always sent whole; the
+    # sections share what is left in priority order, so the lowest-priority
+    # content is trimmed first when the prompt runs over budget
+    remaining = token_budget - count_tokens(render())
+    content = {}
+    for name, section_budget in PROMPT_SECTIONS:
+        content[name] = renderers[name](max(0, min(section_budget, remaining)))
+        remaining -= count_tokens(content[name])
+    
+    prompt = render(**content)
+    logger.debug(
+        "Analysis prompt %s / %s: ~%d tokens (%s)",
+        biobank_name, request_title, count_tokens(prompt),
+        ", ".join(f"{name} {count_tokens(text)}" for name, text in content.items()),
+    )
+    return prompt
+
+
+def analysis_prompt(match, details, biobank_name, request_title, playbook):
+    """Analysis prompt for a match row with its free-text details and playbook context"""
+    if details:
+        # Fields already on the match win, e.g. those of a newly scored request
+        match = {**details, **dict(match)}
+    # Only the playbook sections relevant to this pair (see playbook_index),
+    # as many as the knowledge budget allows
+    return generate_ai_prompt(
+        match, biobank_name, request_title, lambda budget: playbook.context_for(match, budget)
+    )
+
+
+def fallback_analysis(match):
+    """Rule-based summary shown instead of an AI analysis while the AI service is unavailable"""
+    return f"""**AI analysis is temporarily unavailable** - showing a rule-based summary of this match instead.
+
+- **LeadScore:** {match.get('LeadScore', 0):.1f}/10 (disease {match.get('s_disease', 0):.1f}/6, sample type {match.get('s_sample_type', 0):.1f}/2, format {match.get('s_sample_format', 0):.1f}/2)
+- **Disease match:** {match.get('disease_logic', 'Not specified')}
+- **Collaboration terms:** {match.get('collab_logic', 'Not specified')} (request: {match.get('r_collaboration', 'Not specified')}; biobank: {match.get('b_collaboration', 'Not specified')})
+- **Prospective collection:** {match.get('prospective_logic', 'Not specified')} (request: {match.get('r_prospective', 'Not specified')}; biobank: {match.get('b_prospective', 'Not specified')})
+- **Location:** {match.get('geo_logic', 'Not specified')} ({match.get('r_country', 'Not specified')} / {match.get('b_country', 'Not specified')})
+
+Try again in a minute for the full partnership assessment."""
+
+
+FALLBACK_FOLLOWUP = "AI is temporarily unavailable, so this question could not be answered. Please try again in a minute."
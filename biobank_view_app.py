@@ -6,11 +6,39 @@ Updated with card-style view selector and refined UI
 
 import streamlit as st
 import pandas as pd
+import logging
 import os
+import math
+import time
 import uuid
 from datetime import datetime
 import json
-from anthropic import Anthropic
+from ai_cache import ResponseCache, cache_key
+from ai_client import InFlightLimit, build_async_client, shared_client
+from ai_executor import AnalysisJob, AsyncExecutor
+from ai_limits import UpstreamGuard
+from ai_prefetch import AnalysisPrefetcher
+from ai_prompts import (
+    AI_MODEL,
+    ANALYSIS_MAX_TOKENS,
+    FALLBACK_FOLLOWUP,
+    FOLLOWUP_MAX_TOKENS,
+    analysis_prompt,
+    completion_params,
+    fallback_analysis,
+    read_knowledge_base,
+)
+from lead_score import BIOBANK_COLUMNS, BiobankEncoding, score_request
+from match_display import (
+    COLLAB_LOGIC_VALUES,
+    GEO_LOGIC_VALUES,
+    PROSPECTIVE_LOGIC_VALUES,
+    build_display_columns,
+    proximity_order,
+)
+from match_dataset import MatchDataWatcher
+from match_store import STORE_ROW_COLUMN, top_k_positions
+from playbook_index import PlaybookIndex
 
 # Page configuration
 st.set_page_config(
@@ -50,6 +78,29 @@ hide_streamlit_style = """
 """
 st.markdown(hide_streamlit_style, unsafe_allow_html=True)
 
+# Match list paging
+PAGE_SIZE_OPTIONS = [10, 25, 50, 100]
+
+# Choices offered when scoring a new request
+COLLABORATION_OPTIONS = [
+    "Not specified", "Fee-for-service", "Collaboration & co-publication",
+    "Open to discussion", "It depends", "Other",
+]
+PROSPECTIVE_OPTIONS = ["Not specified", "Yes", "No"]
+
+# Seconds between reruns that poll this session's running AI jobs
+AI_POLL_SECONDS = 0.5
+
+# Top-ranked matches whose analyses are prefetched when a request is selected
+PREFETCH_TOP_N = 3
+
+# App modules whose log records (AI token usage, retries, reloads) go to stderr
+APP_LOGGERS = [
+    'ai_batch', 'ai_cache', 'ai_client', 'ai_executor', 'ai_limits', 'ai_prefetch', 'ai_prompts',
+    'match_dataset', 'match_store',
+]
+APP_LOG_LEVEL = os.environ.get("BIOBANK_LOG_LEVEL", "INFO").upper()
+
 # Initialize session state
 def init_session_state():
     """Initialize all session state variables"""
@@ -65,180 +116,178 @@ def init_session_state():
     if 'view_mode' not in st.session_state:
         st.session_state.view_mode = 'biobank'
     
-    if 'anthropic_client' not in st.session_state:
-        api_key = os.environ.get("ANTHROPIC_API_KEY")
-        if api_key:
-            try:
-                st.session_state.anthropic_client = Anthropic(api_key=api_key)
-            except Exception as e:
-                st.session_state.anthropic_client = None
-        else:
-            st.session_state.anthropic_client = None
+    # Match rows whose details are open, and rows already opened by default
+    if 'open_matches' not in st.session_state:
+        st.session_state.open_matches = set()
+    
+    if 'seeded_matches' not in st.session_state:
+        st.session_state.seeded_matches = set()
+    
+
+@st.cache_resource
+def configure_logging():
+    """Send the app modules' log records to stderr, once per process"""
+    # Streamlit only sets up its own logger, so without a handler these
+    # modules' INFO records (per-call token usage among them) are dropped
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    for name in APP_LOGGERS:
+        module_logger = logging.getLogger(name)
+        module_logger.setLevel(APP_LOG_LEVEL)
+        module_logger.addHandler(handler)
+        module_logger.propagate = False
+    return handler
+
+configure_logging()
 
 # Data loading functions
+@st.cache_resource
+def get_match_data():
+    """Process-wide match data that hot-reloads when the source files change"""
+    # The CSV is compiled once into Parquet (s_disease >= 2.0, view columns
+    # only) and then into an Arrow file that every worker memory-maps. The
+    # watcher rebuilds the table, indexes and summaries in the background
+    # when a new data version lands and swaps them in atomically, and merges
+    # delta files from data/pair_scores_delta/ without a full reload. Frames
+    # are shared read-only across sessions, so treat them as immutable.
+    return MatchDataWatcher()
+
+@st.cache_resource(max_entries=2)
+def get_biobank_encoding(base_version=None):
+    """Pre-encoded biobank term matrices for scoring new requests"""
+    # Keyed on the base version: deltas do not rebuild it, a reload does.
+    # Biobank attributes come from one view row per biobank, not the store.
+    dataset = get_match_data().current()
+    if dataset is None:
+        return None
+    return BiobankEncoding(dataset.entity_table('biobank_name', BIOBANK_COLUMNS))
+
 @st.cache_data
-def load_match_data():
-    """Load enriched match scores with context fields"""
-    try:
-        df = pd.read_csv('data/pair_scores_enriched.csv')
-        # Filter out irrelevant matches (s_disease < 2.0)
-        df = df[df['s_disease'] >= 2.0].copy()
-        return df
-    except FileNotFoundError:
-        st.error("Data file not found. Please ensure pair_scores_enriched.csv is in the data folder.")
-        return pd.DataFrame()
+def load_match_details(biobank_name, request_title, store_row=None, data_version=None):
+    """Load the free-text context of one pair for AI prompts"""
+    # data_version is part of the cache key so a reload invalidates entries
+    dataset = get_match_data().current()
+    if dataset is None:
+        return {}
+    return dataset.match_details(biobank_name, request_title, store_row)
 
 @st.cache_data
-def load_knowledge_base():
-    """Load biobanking knowledge base for AI context"""
+def load_biobank_details(biobank_name, data_version=None):
+    """Load the biobank-side free-text context for prompts of a live request"""
+    dataset = get_match_data().current()
+    if dataset is None:
+        return {}
+    return dataset.biobank_details(biobank_name)
+
+@st.cache_resource
+def get_playbook_index():
+    """Index of the biobanking knowledge base for AI context, built once per process"""
     knowledge_content = ""
-    knowledge_path = 'config/knowledge/Playbook_ALL.md'
     
-    if os.path.exists(knowledge_path):
-        try:
-            with open(knowledge_path, 'r', encoding='utf-8') as f:
-                knowledge_content = f.read()
-        except Exception as e:
-            st.warning(f"Could not load knowledge base: {e}")
+    try:
+        knowledge_content = read_knowledge_base()
+    except Exception as e:
+        st.warning(f"Could not load knowledge base: {e}")
     
-    return knowledge_content
+    return PlaybookIndex(knowledge_content)
 
 # AI Analysis functions
-def generate_ai_prompt(match, biobank_name, request_title, knowledge_base):
-    """Generate comprehensive prompt for AI analysis"""
-    
-    # Extract match details
-    disease_score = match.get('s_disease', 0)
-    type_score = match.get('s_sample_type', 0) 
-    format_score = match.get('s_sample_format', 0)
-    lead_score = match.get('LeadScore', 0)
-    
-    # Request context
-    r_disease = match.get('r_disease', 'Not specified')
-    r_sample_type = match.get('r_sample_type', 'Not specified')
-    r_sample_format = match.get('r_sample_format', 'Not specified')
-    r_country = match.get('r_country', 'Not specified')
-    r_collaboration = match.get('r_collaboration', 'Not specified')
-    r_prospective = match.get('r_prospective', 'Not specified')
-    
-    # Additional request context if available
-    r_post_content = match.get('r_post_content', '')
-    r_no_cases = match.get('r_no_cases', '')
-    r_data_required = match.get('r_data_required', '')
-    r_inclusion_criteria = match.get('r_inclusion_criteria', '')
-    r_exclusion_criteria = match.get('r_exclusion_criteria', '')
-    
-    # Biobank context
-    b_disease = match.get('b_disease', 'Not specified')
-    b_sample_type = match.get('b_sample_type', 'Not specified')
-    b_sample_format = match.get('b_sample_format', 'Not specified')
-    b_country = match.get('b_country', 'Not specified')
-    b_collaboration = match.get('b_collaboration', 'Not specified')
-    b_prospective = match.get('b_prospective', 'Not specified')
-    biobank_specialty = match.get('biobank_specialty', 'Not specified')
-    
-    # Additional biobank context if available
-    b_post_content = match.get('b_post_content', '')
-    b_clinical_information = match.get('b_clinical_information', '')
-    b_research_services = match.get('b_research_services', '')
-    b_certifications = match.get('b_certifications', '')
-    
-    prompt = f"""You are a biobank partnership specialist analyzing compatibility between a research request and a biobank.
-Use the provided knowledge base to give specific, actionable guidance.
-
-## KNOWLEDGE BASE CONTEXT
-{knowledge_base[:3000]}  # Truncate to manage token usage
-
-## MATCH OVERVIEW
-Biobank: {biobank_name}
-Research Request: {request_title}
-LeadScore: {lead_score:.1f}/10
-- Disease Match: {disease_score:.1f}/6
-- Sample Type Match: {type_score:.1f}/2
-- Sample Format Match: {format_score:.1f}/2
-
-## REQUEST DETAILS
-Disease Focus: {r_disease}
-Sample Types Needed: {r_sample_type}
-Sample Format: {r_sample_format}
-Location: {r_country}
-**Collaboration Terms Preference: {r_collaboration}**
-**Prospective Collection Required: {r_prospective}**
-
-Additional Context:
-{f'Project Overview: {r_post_content[:500]}' if r_post_content else ''}
-{f'Study Scale: {r_no_cases}' if r_no_cases else ''}
-{f'Data Requirements: {r_data_required}' if r_data_required else ''}
-
-## BIOBANK DETAILS
-Specialty: {biobank_specialty}
-Disease Focus: {b_disease}
-Sample Types Available: {b_sample_type}
-Sample Formats: {b_sample_format}
-Location: {b_country}
-**Collaboration Terms Requirement: {b_collaboration}**
-**Prospective Collection Capability: {b_prospective}**
-
-Additional Context:
-{f'Description: {b_post_content[:500]}' if b_post_content else ''}
-{f'Clinical Data: {b_clinical_information}' if b_clinical_information else ''}
-{f'Services: {b_research_services}' if b_research_services else ''}
-{f'Certifications: {b_certifications}' if b_certifications else ''}
-
-## CRITICAL COMPATIBILITY CHECKS
-
-### COLLABORATION TERMS:
-Request prefers: {r_collaboration}
-Biobank requires: {b_collaboration}
-**IMPORTANT:** If biobank requires "Yes" (mandatory collaboration) but request prefers "fee-for-service", these are INCOMPATIBLE and will require negotiation.
-
-### PROSPECTIVE COLLECTION:
-Request needs: {r_prospective}
-Biobank offers: {b_prospective}
-**IMPORTANT:** If request requires prospective collection ("Yes") but biobank cannot provide it ("No"), this is a MAJOR INCOMPATIBILITY.
-
-## ANALYSIS REQUEST
-Provide a concise partnership assessment covering:
-
-1. **Collaboration Compatibility**: Are the collaboration terms aligned? Flag any conflicts.
-2. **Prospective Collection Match**: Can the biobank meet prospective collection needs if required?
-3. **Match Strengths**: What makes this a good/poor match overall?
-4. **Regulatory Considerations**: Key requirements based on jurisdictions
-5. **Next Steps**: Specific actions, especially addressing any term conflicts
-6. **Potential Deal-Breakers**: Highlight any critical incompatibilities
-
-Keep response under 300 words. Be specific about collaboration and prospective collection issues."""
-
-    return prompt
+@st.cache_resource
+def get_in_flight_limit():
+    """Cap on AI requests in flight shared by the prefetcher and the executor"""
+    return InFlightLimit()
+
+@st.cache_resource
+def get_anthropic_client():
+    """Anthropic client shared by every session, or None without an API key"""
+    # One connection pool per process: sessions reuse warm connections
+    # instead of each opening (and leaking) their own
+    api_key = os.environ.get("ANTHROPIC_API_KEY")
+    if not api_key:
+        return None
+    try:
+        return shared_client(api_key, get_in_flight_limit())
+    except Exception:
+        return None
+
+@st.cache_resource
+def get_upstream_guard():
+    """Rate limits, retries and circuit breaker shared by every AI call in the process"""
+    return UpstreamGuard()
+
+@st.cache_resource
+def get_response_cache():
+    """AI response cache shared by every session and worker process"""
+    return ResponseCache()
+
+@st.cache_resource
+def get_prefetcher():
+    """Process-wide background prefetcher, or None without an API key"""
+    client = get_anthropic_client()
+    if client is None:
+        return None
+    return AnalysisPrefetcher(client, get_response_cache(), AI_MODEL, get_upstream_guard())
+
+@st.cache_resource
+def get_ai_executor():
+    """Process-wide executor that runs AI completions off the script thread, or None without an API key"""
+    api_key = os.environ.get("ANTHROPIC_API_KEY")
+    if not api_key:
+        return None
+    return AsyncExecutor(
+        build_async_client(api_key), get_response_cache(), AI_MODEL, get_upstream_guard(), get_in_flight_limit()
+    )
+
+def submit_completion(prompt, max_tokens, fallback=None):
+    """Start a completion in the background and return its job; cached answers are done at once"""
+    params = completion_params(max_tokens)
+    key = cache_key(AI_MODEL, params, prompt)
+    
+    # A background prefetch of the same prompt may be about to finish
+    prefetcher = get_prefetcher()
+    running = prefetcher.future(key) if prefetcher is not None else None
+    # While the AI service is unhealthy the job ends with the fallback text
+    return get_ai_executor().submit(key, prompt, params, wait_for=running, fallback=fallback)
+
+def has_pending_ai_jobs():
+    """Whether any of this session's analyses or follow-ups is still running"""
+    for state in st.session_state.ai_analyses.values():
+        job = state.get('job')
+        followup = state.get('followup')
+        if (job is not None and not job.done) or (followup is not None and not followup[1].done):
+            return True
+    return False
+
+def build_analysis_prompt(match, biobank_name, request_title):
+    """Analysis prompt for a match, with its free-text details and playbook context"""
+    # Free-text columns are not part of the view projection. Rows of a live
+    # request were scored ad hoc and have no stored row: only the biobank's
+    # side of the context exists.
+    data_version = st.session_state.get('data_version')
+    if STORE_ROW_COLUMN in match:
+        details = load_match_details(biobank_name, request_title, match[STORE_ROW_COLUMN], data_version)
+    else:
+        details = load_biobank_details(biobank_name, data_version)
+    return analysis_prompt(match, details, biobank_name, request_title, get_playbook_index())
 
 def get_ai_analysis(match, biobank_name, request_title):
-    """Get AI analysis for a specific match"""
-    if not st.session_state.anthropic_client:
-        return "AI analysis unavailable - API key not configured"
+    """Start AI analysis for a specific match; returns a job to poll"""
+    if get_ai_executor() is None:
+        return AnalysisJob.completed(None, "AI analysis unavailable - API key not configured")
     
     try:
-        knowledge_base = load_knowledge_base()
-        prompt = generate_ai_prompt(match, biobank_name, request_title, knowledge_base)
-        
-        # Use Claude Haiku for cost efficiency (~$0.001 per analysis)
-        response = st.session_state.anthropic_client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=500,
-            temperature=0.7,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
+        prompt = build_analysis_prompt(match, biobank_name, request_title)
         
-        return response.content[0].text
+        # Repeat analyses of the same prompt come from the shared cache
+        return submit_completion(prompt, max_tokens=ANALYSIS_MAX_TOKENS, fallback=fallback_analysis(match))
         
     except Exception as e:
-        return f"Analysis failed: {str(e)}"
+        return AnalysisJob.completed(None, f"Analysis failed: {str(e)}")
 
 def handle_followup_question(original_analysis, question, match_context):
-    """Handle follow-up questions about the analysis"""
-    if not st.session_state.anthropic_client:
-        return "AI unavailable for follow-up questions"
+    """Start answering a follow-up question about the analysis; returns a job to poll"""
+    if get_ai_executor() is None:
+        return AnalysisJob.completed(None, "AI unavailable for follow-up questions")
     
     try:
         prompt = f"""Previous analysis:
@@ -253,19 +302,37 @@ User's follow-up question: {question}
 
 Provide a specific, helpful answer based on the context. Keep under 200 words."""
 
-        response = st.session_state.anthropic_client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=300,
-            temperature=0.7,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        return response.content[0].text
+        return submit_completion(prompt, max_tokens=FOLLOWUP_MAX_TOKENS, fallback=FALLBACK_FOLLOWUP)
         
     except Exception as e:
-        return f"Follow-up failed: {str(e)}"
+        return AnalysisJob.completed(None, f"Follow-up failed: {str(e)}")
+
+def prefetch_analyses(matches, request_title):
+    """Start background analyses for the top matches of the selected request"""
+    prefetcher = get_prefetcher()
+    if prefetcher is None:
+        return
+    
+    # Moving to another request cancels this session's queued prefetches
+    group = st.session_state.session_id
+    if st.session_state.get('prefetch_request') != request_title:
+        prefetcher.cancel(group)
+        st.session_state.prefetch_request = request_title
+    
+    # Cached or already running prompts are skipped, so reruns cost nothing
+    params = completion_params(ANALYSIS_MAX_TOKENS)
+    for _, match in matches.head(PREFETCH_TOP_N).iterrows():
+        prompt = build_analysis_prompt(match, match['biobank_name'], request_title)
+        prefetcher.submit(group, cache_key(AI_MODEL, params, prompt), prompt, params)
+
+def stop_prefetching():
+    """Cancel this session's queued prefetches"""
+    if not st.session_state.get('prefetch_request'):
+        return
+    prefetcher = get_prefetcher()
+    if prefetcher is not None:
+        prefetcher.cancel(st.session_state.session_id)
+    st.session_state.prefetch_request = None
 
 # Feedback functions
 def save_feedback(feedback_type, context, comment=""):
@@ -302,6 +369,9 @@ def display_scoring_breakdown(match):
     type_score = match.get('s_sample_type', 0)
     format_score = match.get('s_sample_format', 0)
     
+    # Display strings and compatibility labels are precomputed at load time
+    # (see match_display.py); rendering only reads them
+    
     # Prepare data for display
     st.markdown("### Match Details Comparison")
     
@@ -322,213 +392,79 @@ def display_scoring_breakdown(match):
     # Specific Focus row
     col1, col2, col3, col4 = st.columns([1.5, 2, 2, 1.5])
     
-    r_disease = match.get('r_disease', 'Not specified')
-    if r_disease != 'Not specified':
-        r_disease = r_disease.replace(',', ', ')
-    
-    b_disease = match.get('b_disease', 'Not specified')
-    if b_disease != 'Not specified':
-        b_disease = str(b_disease).replace(',', ', ')
-    
-    # Disease matching logic
-    if abs(disease_score - 6) < 0.1:
-        disease_logic = "Exact match (6/6)"
-    elif abs(disease_score - 4) < 0.1:
-        matched_category = match.get('disease_matched_category', '')
-        if matched_category:
-            disease_logic = f"Category: {matched_category} (4/6)"
-        else:
-            disease_logic = "Category match (4/6)"
-    elif abs(disease_score - 2) < 0.1:
-        disease_logic = "General hospital (2/6)"
-    else:
-        disease_logic = f"No alignment ({disease_score:.1f}/6)"
-    
     with col1:
         st.write("**Specific Focus:**")
     with col2:
-        st.write(r_disease)
+        st.write(match['r_disease_display'])
     with col3:
-        st.write(b_disease)
+        st.write(match['b_disease_display'])
         # Add category/specialty info if available
-        b_category = match.get('b_category', '')
-        biobank_specialty = match.get('biobank_specialty', '')
-        if b_category and b_category != 'Not specified':
-            st.caption(f"Categories: {str(b_category).replace(',', ', ')}")
-        if biobank_specialty and biobank_specialty != 'Not specified':
-            st.caption(f"Specialty: {biobank_specialty}")
+        if match['b_category_display']:
+            st.caption(f"Categories: {match['b_category_display']}")
+        if match['biobank_specialty_display']:
+            st.caption(f"Specialty: {match['biobank_specialty_display']}")
     with col4:
-        st.write(disease_logic)
+        st.write(match['disease_logic'])
     
     # Sample Type row
     col1, col2, col3, col4 = st.columns([1.5, 2, 2, 1.5])
     
-    r_sample_type = match.get('r_sample_type', 'Not specified')
-    if r_sample_type != 'Not specified':
-        r_sample_type = r_sample_type.replace(',', ', ')
-    
-    b_sample_type = match.get('b_sample_type', 'Not specified')
-    if b_sample_type != 'Not specified':
-        b_sample_type = b_sample_type.replace(',', ', ')
-    
     with col1:
         st.write("**Sample Type:**")
     with col2:
-        st.write(r_sample_type)
+        st.write(match['r_sample_type_display'])
     with col3:
-        st.write(b_sample_type)
+        st.write(match['b_sample_type_display'])
     with col4:
         st.write(f"Match score: {int(type_score)}/2")
     
     # Sample Format row
     col1, col2, col3, col4 = st.columns([1.5, 2, 2, 1.5])
     
-    r_sample_format = match.get('r_sample_format', 'Not specified')
-    if r_sample_format != 'Not specified':
-        r_sample_format = r_sample_format.replace(',', ', ')
-    
-    b_sample_format = match.get('b_sample_format', 'Not specified')
-    if b_sample_format != 'Not specified':
-        b_sample_format = b_sample_format.replace(',', ', ')
-    
     with col1:
         st.write("**Sample Format:**")
     with col2:
-        st.write(r_sample_format)
+        st.write(match['r_sample_format_display'])
     with col3:
-        st.write(b_sample_format)
+        st.write(match['b_sample_format_display'])
     with col4:
         st.write(f"Match score: {int(format_score)}/2")
     
     # Geographic Location row
     col1, col2, col3, col4 = st.columns([1.5, 2, 2, 1.5])
     
-    r_country = match.get('r_country', 'Not specified')
-    b_country = match.get('b_country', 'Not specified')
-    
-    # Determine geographic compatibility
-    if r_country == b_country and r_country != 'Not specified':
-        geo_logic = "Same country"
-    elif r_country == 'Not specified' or b_country == 'Not specified':
-        geo_logic = "Location unclear"
-    else:
-        # Check for common regional blocks
-        eu_countries = ['Germany', 'France', 'Spain', 'Italy', 'Netherlands', 'Belgium', 'Austria', 'Poland']
-        if r_country in eu_countries and b_country in eu_countries:
-            geo_logic = "Both in EU"
-        elif (r_country == 'United States' and b_country == 'Canada') or (r_country == 'Canada' and b_country == 'United States'):
-            geo_logic = "US-Canada"
-        else:
-            geo_logic = f"Cross-border ({calculate_distance(r_country, b_country)})"
-    
     with col1:
         st.write("**Location:**")
     with col2:
-        st.write(r_country)
+        st.write(match['r_country_display'])
     with col3:
-        st.write(b_country)
+        st.write(match['b_country_display'])
     with col4:
-        st.write(geo_logic)
+        st.write(match['geo_logic'])
     
     # Preferred Terms of Engagement row
     col1, col2, col3, col4 = st.columns([1.5, 2, 2, 1.5])
     
-    r_collaboration = match.get('r_collaboration', 'Not specified')
-    b_collaboration = match.get('b_collaboration', 'Not specified')
-    
-    # Format request collaboration for display with proper capitalization
-    if r_collaboration.lower() == 'fee-for-service':
-        r_collab_display = 'Fee-for-service'
-    elif r_collaboration.lower() == 'collaboration & co-publication':
-        r_collab_display = 'Collaboration & co-publication'
-    elif r_collaboration.lower() == 'open to discussion':
-        r_collab_display = 'Open to discussion'
-    elif r_collaboration.lower() == 'it depends':
-        r_collab_display = 'It depends'
-    elif r_collaboration.lower() == 'other':
-        r_collab_display = 'Other'
-    else:
-        r_collab_display = r_collaboration
-    
-    # Convert biobank collaboration values to new terminology
-    if b_collaboration == 'Yes':
-        b_collab_display = 'Collaboration required'
-    elif b_collaboration == 'Yes if possible':
-        b_collab_display = 'Collaboration if possible'
-    elif b_collaboration == 'No':
-        b_collab_display = 'Collaboration not required'
-    elif b_collaboration == 'Sometimes':
-        b_collab_display = 'Collaboration sometimes required'
-    else:
-        b_collab_display = b_collaboration if b_collaboration else 'Not specified'
-    
-    # Determine compatibility logic for collaboration
-    if r_collaboration.lower() == 'open to discussion':
-        collab_logic = "Flexible"
-    elif r_collaboration.lower() in ['it depends', 'other']:
-        collab_logic = "Check specifics"
-    elif r_collaboration.lower() == 'fee-for-service' and b_collaboration == 'Yes':
-        collab_logic = "Conflict"
-    elif r_collaboration.lower() == 'collaboration & co-publication' and b_collaboration == 'No':
-        collab_logic = "Conflict"
-    elif b_collaboration in ['Not specified', '', None]:
-        collab_logic = "Terms unclear"
-    else:
-        collab_logic = "Check compatibility"
-    
     with col1:
         st.write("**Preferred Terms of Engagement:**")
     with col2:
-        st.write(r_collab_display)
+        st.write(match['r_collab_display'])
     with col3:
-        st.write(b_collab_display)
+        st.write(match['b_collab_display'])
     with col4:
-        st.write(collab_logic)
+        st.write(match['collab_logic'])
     
     # Prospective Collection row
     col1, col2, col3, col4 = st.columns([1.5, 2, 2, 1.5])
     
-    r_prospective = match.get('r_prospective', 'Not specified')
-    b_prospective = match.get('b_prospective', 'Not specified')
-    
-    # Format request prospective for display
-    if r_prospective == 'Yes':
-        r_prosp_display = 'Requires prospective collection'
-    elif r_prospective == 'No':
-        r_prosp_display = 'Does not require prospective collection'
-    else:
-        r_prosp_display = 'Not specified'
-    
-    # Format biobank prospective for display
-    if b_prospective == 'Yes':
-        b_prosp_display = 'Can do prospective collection'
-    elif b_prospective == 'No':
-        b_prosp_display = 'Cannot do prospective collection'
-    elif b_prospective == 'Sometimes':
-        b_prosp_display = 'Can sometimes do prospective collection'
-    else:
-        b_prosp_display = 'Not specified'
-    
-    # Determine prospective compatibility
-    if r_prospective == 'Yes' and b_prospective == 'No':
-        prospective_logic = "Cannot meet"
-    elif r_prospective == 'Yes' and b_prospective == 'Sometimes':
-        prospective_logic = "Conditional"
-    elif r_prospective == b_prospective and r_prospective != 'Not specified':
-        prospective_logic = "Aligned"
-    elif b_prospective == 'Not specified' or r_prospective == 'Not specified':
-        prospective_logic = "Unclear"
-    else:
-        prospective_logic = "Compatible"
-    
     with col1:
         st.write("**Prospective Collection:**")
     with col2:
-        st.write(r_prosp_display)
+        st.write(match['r_prosp_display'])
     with col3:
-        st.write(b_prosp_display)
+        st.write(match['b_prosp_display'])
     with col4:
-        st.write(prospective_logic)
+        st.write(match['prospective_logic'])
     
     # Total LeadScore summary
     st.markdown("---")
@@ -558,24 +494,24 @@ def display_scoring_breakdown(match):
         else:
             st.caption("Weak match - Significant gaps in alignment")
 
-def calculate_distance(country1, country2):
-    """Simple helper to describe geographic relationship"""
-    if country1 == 'Not specified' or country2 == 'Not specified':
-        return "unknown"
-    
-    # Define some common relationships
-    same_continent = {
-        'Europe': ['Germany', 'France', 'Spain', 'Italy', 'United Kingdom', 'Netherlands', 'Belgium', 'Austria'],
-        'North America': ['United States', 'Canada', 'Mexico'],
-        'Asia': ['China', 'Japan', 'Singapore', 'India'],
-        'Oceania': ['Australia', 'New Zealand']
-    }
-    
-    for continent, countries in same_continent.items():
-        if country1 in countries and country2 in countries:
-            return "same region"
-    
-    return "different regions"
+def display_entity_overview(summary, entity_label):
+    """Display a sortable overview table of every entity's summary metrics"""
+    overview = summary[['matches', 'avg_score', 'top_score', 'high_matches', 'near_perfect']].rename(columns={
+        'matches': 'Matches',
+        'avg_score': 'Average Score',
+        'top_score': 'Top Score',
+        'high_matches': 'High Matches (7+)',
+        'near_perfect': 'Near-Perfect (9.5+)',
+    })
+    overview.index.name = entity_label
+    st.dataframe(
+        overview.sort_values('Average Score', ascending=False),
+        use_container_width=True,
+        column_config={
+            'Average Score': st.column_config.NumberColumn(format="%.1f"),
+            'Top Score': st.column_config.NumberColumn(format="%.1f"),
+        },
+    )
 
 def display_ai_analysis_section(match, biobank_name, request_title, match_key):
     """Display AI analysis section with follow-up capability"""
@@ -589,16 +525,29 @@ def display_ai_analysis_section(match, biobank_name, request_title, match_key):
         st.session_state.ai_analyses[analysis_key] = {
             'analysis': None,
             'qa_history': [],
-            'feedback_given': False
+            'feedback_given': False,
+            'job': None,
+            'followup': None
         }
     
     # AI Analysis button - styled without columns
     st.markdown("---")  # Add a separator line above
     if st.button("Get AI Analysis", key=f"ai_btn_{match_key}"):
-        with st.spinner("Analyzing partnership compatibility..."):
-            analysis = get_ai_analysis(match, biobank_name, request_title)
+        # The analysis runs on the executor thread; later reruns poll its job
+        st.session_state.ai_analyses[analysis_key]['job'] = get_ai_analysis(match, biobank_name, request_title)
+    
+    # Text streamed so far shows while the job runs; once done it is stored
+    # and shown below like any other analysis
+    job = st.session_state.ai_analyses[analysis_key].get('job')
+    if job is not None:
+        if job.done:
+            analysis = job.text if job.error is None else f"Analysis failed: {job.error}"
             st.session_state.ai_analyses[analysis_key]['analysis'] = analysis
-            st.rerun()
+            st.session_state.ai_analyses[analysis_key]['job'] = None
+        elif job.text:
+            st.markdown(f"### AI Partnership Assessment\n\n{job.text}▌")
+        else:
+            st.info("⏳ AI analysis in progress...")
         
     # Display analysis if available
     if st.session_state.ai_analyses[analysis_key]['analysis']:
@@ -606,39 +555,53 @@ def display_ai_analysis_section(match, biobank_name, request_title, match_key):
         # Display analysis directly without word count
         st.write(st.session_state.ai_analyses[analysis_key]['analysis'])
         
+        # A finished follow-up joins the Q&A history
+        followup = st.session_state.ai_analyses[analysis_key].get('followup')
+        if followup is not None and followup[1].done:
+            question, job = followup
+            answer = job.text if job.error is None else f"Follow-up failed: {job.error}"
+            st.session_state.ai_analyses[analysis_key]['qa_history'].append({
+                'question': question,
+                'answer': answer
+            })
+            st.session_state.ai_analyses[analysis_key]['followup'] = followup = None
+        
         # Display Q&A history
         for qa in st.session_state.ai_analyses[analysis_key]['qa_history']:
             st.info(f"**Q:** {qa['question']}")
             st.write(f"**A:** {qa['answer']}")
         
-        # Follow-up question form
-        with st.form(key=f"qa_form_{match_key}_{len(st.session_state.ai_analyses[analysis_key]['qa_history'])}"):
-            st.markdown("#### Ask a follow-up question")
-            question = st.text_input(
-                "Your question:",
-                placeholder="e.g., What are the specific regulatory requirements for this transfer?"
-            )
-            submitted = st.form_submit_button("Ask", type="primary")
-            
-            if submitted and question:
-                match_context = {
-                    'biobank_name': biobank_name,
-                    'request_title': request_title,
-                    'lead_score': match.get('LeadScore', 0)
-                }
+        # A running follow-up shows its partial answer in place of the form
+        if followup is not None:
+            st.info(f"**Q:** {followup[0]}")
+            st.write(f"**A:** {followup[1].text}▌")
+        else:
+            # Follow-up question form
+            with st.form(key=f"qa_form_{match_key}_{len(st.session_state.ai_analyses[analysis_key]['qa_history'])}"):
+                st.markdown("#### Ask a follow-up question")
+                question = st.text_input(
+                    "Your question:",
+                    placeholder="e.g., What are the specific regulatory requirements for this transfer?"
+                )
+                submitted = st.form_submit_button("Ask", type="primary")
                 
-                with st.spinner("Getting answer..."):
-                    answer = handle_followup_question(
-                        st.session_state.ai_analyses[analysis_key]['analysis'],
+                if submitted and question:
+                    match_context = {
+                        'biobank_name': biobank_name,
+                        'request_title': request_title,
+                        'lead_score': match.get('LeadScore', 0)
+                    }
+                    
+                    # The answer is polled like an analysis and moves into the
+                    # history above a fresh form once done
+                    st.session_state.ai_analyses[analysis_key]['followup'] = (
                         question,
-                        match_context
+                        handle_followup_question(
+                            st.session_state.ai_analyses[analysis_key]['analysis'],
+                            question,
+                            match_context
+                        )
                     )
-                    
-                    # Store Q&A
-                    st.session_state.ai_analyses[analysis_key]['qa_history'].append({
-                        'question': question,
-                        'answer': answer
-                    })
                     st.rerun()
         
         # Enhanced feedback section with text input
@@ -694,6 +657,120 @@ def display_ai_analysis_section(match, biobank_name, request_title, match_key):
             st.markdown("---")
             st.info("Thank you for providing feedback on this match!")
 
+def _toggle_match(match_key):
+    """Checkbox callback: open or close a match row's details"""
+    if match_key in st.session_state.open_matches:
+        st.session_state.open_matches.discard(match_key)
+    else:
+        st.session_state.open_matches.add(match_key)
+
+def match_details_open(label, match_key, default_open=False):
+    """Render a collapsed match row; return True if its details should be built"""
+    # Open the default row once; after that the user's choice sticks
+    if default_open and match_key not in st.session_state.seeded_matches:
+        st.session_state.seeded_matches.add(match_key)
+        st.session_state.open_matches.add(match_key)
+    
+    return st.checkbox(
+        label,
+        value=match_key in st.session_state.open_matches,
+        key=f"open_{match_key}",
+        on_change=_toggle_match,
+        args=(match_key,)
+    )
+
+def render_compatibility_filters(state_key):
+    """Render filters on the precomputed compatibility labels"""
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        hidden_collab = st.multiselect(
+            "Hide collaboration terms",
+            options=COLLAB_LOGIC_VALUES,
+            key=f"{state_key}_hide_collab"
+        )
+    with col2:
+        hidden_prospective = st.multiselect(
+            "Hide prospective collection",
+            options=PROSPECTIVE_LOGIC_VALUES,
+            key=f"{state_key}_hide_prospective"
+        )
+    with col3:
+        hidden_geo = st.multiselect(
+            "Hide locations",
+            options=GEO_LOGIC_VALUES,
+            key=f"{state_key}_hide_geo"
+        )
+    return {
+        'collab_logic': hidden_collab,
+        'prospective_logic': hidden_prospective,
+        'geo_logic': hidden_geo,
+    }
+
+def render_sort_control(state_key):
+    """Render the match ordering choice; True when sorting by proximity"""
+    sort_by = st.radio(
+        "Sort by",
+        ["LeadScore", "Proximity"],
+        horizontal=True,
+        key=f"{state_key}_sort",
+        help="Proximity puts same-country and same-bloc partners first, then orders by LeadScore"
+    )
+    return sort_by == "Proximity"
+
+def _shift_page(page_key, delta, page_count):
+    """Button callback: move the page number by delta within bounds"""
+    st.session_state[page_key] = min(max(st.session_state.get(page_key, 1) + delta, 1), page_count)
+
+def render_page_controls(total_items, state_key):
+    """Render page size and prev/next/jump controls; return the visible row range"""
+    page_key = f"{state_key}_page"
+    
+    col1, col2, col3, col4 = st.columns([1.5, 1, 1, 1.5])
+    
+    with col1:
+        page_size = st.selectbox(
+            "Matches per page",
+            options=PAGE_SIZE_OPTIONS,
+            key="page_size"
+        )
+    
+    page_count = max(1, math.ceil(total_items / page_size))
+    
+    # Clamp before the widget is created, e.g. after a larger page size
+    if st.session_state.get(page_key, 1) > page_count:
+        st.session_state[page_key] = page_count
+    current_page = st.session_state.get(page_key, 1)
+    
+    with col2:
+        st.button(
+            "Previous",
+            key=f"{state_key}_prev",
+            disabled=current_page <= 1,
+            on_click=_shift_page,
+            args=(page_key, -1, page_count)
+        )
+    with col3:
+        st.button(
+            "Next",
+            key=f"{state_key}_next",
+            disabled=current_page >= page_count,
+            on_click=_shift_page,
+            args=(page_key, 1, page_count)
+        )
+    with col4:
+        page = st.number_input(
+            f"Page (of {page_count})",
+            min_value=1,
+            max_value=page_count,
+            step=1,
+            key=page_key
+        )
+    
+    start = (page - 1) * page_size
+    end = min(start + page_size, total_items)
+    st.caption(f"Showing matches {start + 1}-{end} of {total_items}")
+    return start, end
+
 def render_view_selector():
     """Render card-style view selector with clickable cards"""
     
@@ -767,12 +844,17 @@ def render_view_selector():
     </style>
     """, unsafe_allow_html=True)
             
-def render_biobank_view(match_scores):
+def render_biobank_view(dataset):
     """Render the biobank-centric view"""
+    # Prefetches only serve the request view; stop spending the budget on them
+    stop_prefetching()
     st.info("Select a biobank to explore matching research requests")
     
-    # Get unique biobanks
-    unique_biobanks = sorted(match_scores['biobank_name'].unique())
+    biobank_index = dataset.indexes['biobank_name']
+    biobank_summary = dataset.summaries['biobank_name']
+    
+    # Get unique biobanks (index keys are already sorted)
+    unique_biobanks = list(biobank_index)
     
     # Biobank selector
     col1, col2 = st.columns([3, 1])
@@ -787,66 +869,230 @@ def render_biobank_view(match_scores):
     with col2:
         st.metric("Biobanks with Relevant Matches", len(unique_biobanks))
     
+    # Overview table is built from the summary, never from the pair rows
+    if st.checkbox("Show overview of all biobanks", key="biobank_overview"):
+        display_entity_overview(biobank_summary, "Biobank")
+    
     if selected_biobank:
-        # Get matches for selected biobank
-        biobank_matches = match_scores[
-            match_scores['biobank_name'] == selected_biobank
-        ].copy()
-        
-        # Sort by LeadScore
-        if 'LeadScore' in biobank_matches.columns:
-            biobank_matches = biobank_matches.sort_values('LeadScore', ascending=False)
+        # Get matches for selected biobank, already sorted by LeadScore
+        biobank_positions = biobank_index[selected_biobank]
         
         st.markdown(f"## {selected_biobank}")
         
-        # Display metrics
+        # Display metrics (precomputed at load time)
+        summary = biobank_summary.loc[selected_biobank]
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("Matching Requests", len(biobank_matches))
+            st.metric("Matching Requests", int(summary['matches']))
         with col2:
-            avg_score = biobank_matches['LeadScore'].mean()
-            st.metric("Average Score", f"{avg_score:.1f}/10")
+            st.metric("Average Score", f"{summary['avg_score']:.1f}/10")
         with col3:
-            high_matches = len(biobank_matches[biobank_matches['LeadScore'] >= 7])
-            st.metric("High Matches (7+)", high_matches)
+            st.metric("High Matches (7+)", int(summary['high_matches']))
         
         st.markdown("---")
         st.markdown("### Research Requests Matching This Biobank")
         
-        # Display each match
-        for idx, (_, match) in enumerate(biobank_matches.iterrows()):
+        exclusions = render_compatibility_filters("biobank")
+        biobank_positions = dataset.exclude(biobank_positions, exclusions)
+        
+        # Positions are in LeadScore order, so a stable sort keeps it within each location tier
+        if render_sort_control("biobank"):
+            biobank_positions = biobank_positions[proximity_order(dataset.column('geo_logic', biobank_positions))]
+        
+        # Only the visible page is rendered, so first paint does not grow
+        # with the number of matches
+        start, end = render_page_controls(len(biobank_positions), f"biobank_{selected_biobank}")
+        page_matches = dataset.take(biobank_positions[start:end])
+        
+        # Display each match on this page
+        for idx, (_, match) in enumerate(page_matches.iterrows(), start=start):
             request_title = match.get('post_title', 'Unknown Request')
             lead_score = match.get('LeadScore', 0)
             
             # Create unique key for this match
             match_key = f"biobank_{selected_biobank}_{request_title}_{idx}"
             
-            with st.expander(
+            # Collapsed rows only show title and score; the breakdown and
+            # AI section are built for rows the user has opened
+            if match_details_open(
                 f"**Match {idx + 1}:** {request_title} (Score: {lead_score:.1f}/10)",
-                expanded=(idx == 0)  # Only expand the first match
+                match_key,
+                default_open=(idx == 0)  # Only open the first match
             ):
-                st.markdown(f"## {request_title}")
-                
-                # Display scoring breakdown
-                display_scoring_breakdown(match)
-                
-                # Add separator before AI section
-                st.markdown("---")
+                with st.container():
+                    st.markdown(f"## {request_title}")
+                    
+                    # Display scoring breakdown
+                    display_scoring_breakdown(match)
+                    
+                    # Add separator before AI section
+                    st.markdown("---")
+                    
+                    # Display AI analysis section
+                    display_ai_analysis_section(
+                        match,
+                        selected_biobank,
+                        request_title,
+                        match_key
+                    )
+                    st.markdown("---")
+
+def render_ranked_biobanks(matches, request_title, key_prefix, min_score):
+    """Render ranked biobank rows for one request with lazy breakdown and AI sections"""
+    if len(matches) == 0:
+        st.warning(f"No biobanks found with LeadScore >= {min_score:.1f}")
+    else:
+        # Display each biobank match
+        for idx, (_, match) in enumerate(matches.iterrows()):
+            biobank_name = match.get('biobank_name', 'Unknown Biobank')
+            lead_score = match.get('LeadScore', 0)
+            
+            # Create unique key for this match
+            match_key = f"{key_prefix}_{request_title}_{biobank_name}_{idx}"
+            
+            # Color code the row based on score
+            if lead_score >= 8:
+                score_indicator = "[HIGH]"
+            elif lead_score >= 6:
+                score_indicator = "[MEDIUM]"
+            else:
+                score_indicator = "[LOW]"
+            
+            # Collapsed rows only show title and score; the breakdown and
+            # AI section are built for rows the user has opened
+            if match_details_open(
+                f"{score_indicator} **Rank {idx + 1}:** {biobank_name} (Score: {lead_score:.1f}/10)",
+                match_key,
+                default_open=(idx == 0)  # Only open the first (top-ranked) match
+            ):
+                with st.container():
+                    st.markdown(f"## {biobank_name}")
+                    
+                    # Display scoring breakdown
+                    display_scoring_breakdown(match)
+                    
+                    # Add separator before AI section
+                    st.markdown("---")
+                    
+                    # Display AI analysis section
+                    display_ai_analysis_section(
+                        match,
+                        biobank_name,
+                        request_title,
+                        match_key
+                    )
+                    st.markdown("---")
                 
-                # Display AI analysis section
-                display_ai_analysis_section(
-                    match,
-                    selected_biobank,
-                    request_title,
-                    match_key
-                )
+def render_live_request_view(dataset):
+    """Score a new request against every biobank and rank the results"""
+    # Prefetches only serve existing requests; stop spending the budget on them
+    stop_prefetching()
+    st.info("Describe a research request to rank every biobank against it")
+    
+    encoding = get_biobank_encoding(dataset.base_version)
+    if encoding is None:
+        st.error("Biobank data not available for scoring.")
+        return
+    
+    # Options come from the biobank vocabulary; other terms could never match
+    with st.form(key="live_request_form"):
+        request_title = st.text_input("Request title", value="New research request")
+        col1, col2 = st.columns(2)
+        with col1:
+            diseases = st.multiselect("Disease focus", encoding.spellings['disease'])
+            categories = st.multiselect("Disease categories", encoding.spellings['category'])
+            sample_types = st.multiselect("Sample types", encoding.spellings['sample_type'])
+        with col2:
+            sample_formats = st.multiselect("Sample formats", encoding.spellings['sample_format'])
+            countries = sorted(encoding.biobanks['b_country'].dropna().unique()) if 'b_country' in encoding.biobanks else []
+            country = st.selectbox("Location", ["Not specified"] + [c for c in countries if c != "Not specified"])
+            collaboration = st.selectbox("Collaboration", COLLABORATION_OPTIONS)
+            prospective = st.selectbox("Prospective collection required", PROSPECTIVE_OPTIONS)
+        submitted = st.form_submit_button("Rank biobanks", type="primary")
+    
+    if submitted:
+        # Kept in session state so the results survive reruns from the rows below
+        st.session_state.live_request = {
+            'post_title': request_title or "New research request",
+            'r_disease': ",".join(diseases) or "Not specified",
+            'r_category': ",".join(categories) or "Not specified",
+            'r_sample_type': ",".join(sample_types) or "Not specified",
+            'r_sample_format': ",".join(sample_formats) or "Not specified",
+            'r_country': country,
+            'r_collaboration': collaboration,
+            'r_prospective': prospective,
+        }
+    
+    live_request = st.session_state.get('live_request')
+    if not live_request:
+        return
+    
+    started = time.perf_counter()
+    ranked = score_request(live_request, encoding)
+    ranked = pd.concat([ranked, build_display_columns(ranked)], axis=1)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    request_title = live_request['post_title']
+    st.markdown(f"## {request_title}")
+    st.caption(f"Scored {len(ranked):,} biobanks in {elapsed_ms:.0f} ms")
+    
+    st.markdown("---")
+    col1, col2 = st.columns(2)
+    with col1:
+        top_k = st.number_input(
+            "Number of biobanks to show",
+            min_value=1,
+            max_value=100,
+            value=10,
+            step=1,
+            key="live_top_k"
+        )
+    with col2:
+        min_score = st.slider(
+            "Minimum LeadScore",
+            min_value=0.0,
+            max_value=10.0,
+            value=5.0,
+            step=0.5,
+            key="live_min_score"
+        )
+    
+    st.markdown(f"### Top {top_k} Biobanks for This Request")
+    
+    exclusions = render_compatibility_filters("live")
+    for column, values in exclusions.items():
+        if values:
+            ranked = ranked[~ranked[column].isin(values)]
+    
+    lead_scores = ranked['LeadScore'].to_numpy(dtype=float)
+    if render_sort_control("live"):
+        ranked = ranked[lead_scores >= min_score]
+        matches = ranked.iloc[proximity_order(ranked['geo_logic'])[:top_k]]
+    else:
+        matches = ranked.iloc[top_k_positions(lead_scores, top_k, min_score)]
+    
+    render_ranked_biobanks(matches, request_title, "live", min_score)
 
-def render_request_view(match_scores):
+def render_request_view(dataset):
     """Render the request-centric view"""
+    request_source = st.radio(
+        "Request",
+        ["Existing request", "Score a new request"],
+        horizontal=True,
+        key="request_source",
+        label_visibility="collapsed"
+    )
+    if request_source == "Score a new request":
+        render_live_request_view(dataset)
+        return
+    
     st.info("Select a research request to see the best matching biobanks")
     
-    # Get unique requests
-    unique_requests = sorted(match_scores['post_title'].unique())
+    request_index = dataset.indexes['post_title']
+    request_summary = dataset.summaries['post_title']
+    
+    # Get unique requests (index keys are already sorted)
+    unique_requests = list(request_index)
     
     # Request selector
     col1, col2 = st.columns([3, 1])
@@ -861,21 +1107,19 @@ def render_request_view(match_scores):
     with col2:
         st.metric("Total Requests", len(unique_requests))
     
+    # Overview table is built from the summary, never from the pair rows
+    if st.checkbox("Show overview of all requests", key="request_overview"):
+        display_entity_overview(request_summary, "Research Request")
+    
     if selected_request:
-        # Get matches for selected request
-        request_matches = match_scores[
-            match_scores['post_title'] == selected_request
-        ].copy()
-        
-        # Sort by LeadScore descending (best matches first)
-        if 'LeadScore' in request_matches.columns:
-            request_matches = request_matches.sort_values('LeadScore', ascending=False)
+        # Get matches for selected request, best matches first
+        request_positions = request_index[selected_request]
         
         st.markdown(f"## {selected_request}")
         
         # Display request details if available
-        if not request_matches.empty:
-            first_match = request_matches.iloc[0]
+        if len(request_positions) > 0:
+            first_match = dataset.take(request_positions[:1]).iloc[0]
             
             # Show request requirements in a clean box
             with st.container():
@@ -883,94 +1127,82 @@ def render_request_view(match_scores):
                 col1, col2, col3 = st.columns(3)
                 
                 with col1:
-                    r_disease = first_match.get('r_disease', 'Not specified')
-                    if r_disease != 'Not specified':
-                        r_disease = r_disease.replace(',', ', ')
-                    st.write(f"**Disease Focus:** {r_disease}")
-                    
-                    r_sample_type = first_match.get('r_sample_type', 'Not specified')
-                    if r_sample_type != 'Not specified':
-                        r_sample_type = r_sample_type.replace(',', ', ')
-                    st.write(f"**Sample Type:** {r_sample_type}")
+                    st.write(f"**Disease Focus:** {first_match['r_disease_display']}")
+                    st.write(f"**Sample Type:** {first_match['r_sample_type_display']}")
                 
                 with col2:
-                    r_sample_format = first_match.get('r_sample_format', 'Not specified')
-                    if r_sample_format != 'Not specified':
-                        r_sample_format = r_sample_format.replace(',', ', ')
-                    st.write(f"**Sample Format:** {r_sample_format}")
-                    
-                    r_country = first_match.get('r_country', 'Not specified')
-                    st.write(f"**Location:** {r_country}")
+                    st.write(f"**Sample Format:** {first_match['r_sample_format_display']}")
+                    st.write(f"**Location:** {first_match['r_country_display']}")
                 
                 with col3:
-                    r_collaboration = first_match.get('r_collaboration', 'Not specified')
-                    st.write(f"**Collaboration:** {r_collaboration}")
+                    st.write(f"**Collaboration:** {first_match['r_collab_display']}")
                     
                     r_prospective = first_match.get('r_prospective', 'Not specified')
                     st.write(f"**Prospective:** {r_prospective}")
         
-        # Display metrics
+        # Display metrics (precomputed at load time)
+        summary = request_summary.loc[selected_request]
         st.markdown("---")
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Matching Biobanks", len(request_matches))
+            st.metric("Matching Biobanks", int(summary['matches']))
         with col2:
-            avg_score = request_matches['LeadScore'].mean()
-            st.metric("Average Score", f"{avg_score:.1f}/10")
+            st.metric("Average Score", f"{summary['avg_score']:.1f}/10")
         with col3:
-            high_matches = len(request_matches[request_matches['LeadScore'] >= 7])
-            st.metric("High Matches (7+)", high_matches)
+            st.metric("High Matches (7+)", int(summary['high_matches']))
         with col4:
-            perfect_matches = len(request_matches[request_matches['LeadScore'] >= 9.5])
-            st.metric("Near-Perfect (9.5+)", perfect_matches)
+            st.metric("Near-Perfect (9.5+)", int(summary['near_perfect']))
         
         st.markdown("---")
         
-        # Display top 10 matches (removed filter controls)
-        st.markdown(f"### Top 10 Biobanks for This Request")
+        # Ranking controls
+        col1, col2 = st.columns(2)
+        with col1:
+            top_k = st.number_input(
+                "Number of biobanks to show",
+                min_value=1,
+                max_value=100,
+                value=10,
+                step=1,
+                key="request_top_k"
+            )
+        with col2:
+            min_score = st.slider(
+                "Minimum LeadScore",
+                min_value=0.0,
+                max_value=10.0,
+                value=5.0,
+                step=0.5,
+                key="request_min_score"
+            )
+        
+        st.markdown(f"### Top {top_k} Biobanks for This Request")
         
-        # Get top 10 matches with score >= 5
-        filtered_matches = request_matches[request_matches['LeadScore'] >= 5.0].head(10)
+        exclusions = render_compatibility_filters("request")
+        request_positions = dataset.exclude(request_positions, exclusions)
         
-        if len(filtered_matches) == 0:
-            st.warning("No biobanks found with LeadScore >= 5.0")
+        lead_scores = dataset.column('LeadScore', request_positions).astype(float)
+        if render_sort_control("request"):
+            # Closest locations first among the matches above the threshold
+            request_positions = request_positions[lead_scores >= min_score]
+            geo_labels = dataset.column('geo_logic', request_positions)
+            top_positions = request_positions[proximity_order(geo_labels)[:top_k]]
         else:
-            # Display each biobank match
-            for idx, (_, match) in enumerate(filtered_matches.iterrows()):
-                biobank_name = match.get('biobank_name', 'Unknown Biobank')
-                lead_score = match.get('LeadScore', 0)
-                
-                # Create unique key for this match
-                match_key = f"request_{selected_request}_{biobank_name}_{idx}"
-                
-                # Color code the expander based on score
-                if lead_score >= 8:
-                    score_indicator = "[HIGH]"
-                elif lead_score >= 6:
-                    score_indicator = "[MEDIUM]"
-                else:
-                    score_indicator = "[LOW]"
-                
-                with st.expander(
-                    f"{score_indicator} **Rank {idx + 1}:** {biobank_name} (Score: {lead_score:.1f}/10)",
-                    expanded=(idx == 0)  # Only expand the first (top-ranked) match
-                ):
-                    st.markdown(f"## {biobank_name}")
-                    
-                    # Display scoring breakdown
-                    display_scoring_breakdown(match)
-                    
-                    # Add separator before AI section
-                    st.markdown("---")
-                    
-                    # Display AI analysis section
-                    display_ai_analysis_section(
-                        match,
-                        biobank_name,
-                        selected_request,
-                        match_key
-                    )
-                    
+            # Select the top k matches with score >= threshold without sorting
+            # every candidate; ties keep the same order as a stable full sort
+            top_positions = request_positions[top_k_positions(lead_scores, top_k, min_score)]
+        filtered_matches = dataset.take(top_positions)
+        
+        if get_prefetcher() is not None and st.toggle(
+            f"Prefetch AI analyses for the top {PREFETCH_TOP_N} matches",
+            key="request_prefetch"
+        ):
+            prefetch_analyses(filtered_matches, selected_request)
+        else:
+            stop_prefetching()
+        
+        render_ranked_biobanks(filtered_matches, selected_request, "request", min_score)
+    
 # Main application
 def main():
     # Initialize session state
@@ -982,20 +1214,46 @@ def main():
     st.markdown("---")
     
     # Load data
-    match_scores = load_match_data()
+    # Take one snapshot for the whole run: a reload that lands mid-run is
+    # picked up on this session's next rerun
+    dataset = get_match_data().current()
+    
+    if dataset is None:
+        st.error("Data file not found. Please ensure pair_scores_enriched.csv is in the data folder.")
+        return
+    
+    match_scores = dataset.frame
+    st.session_state.data_version = dataset.version
     
     if match_scores.empty:
         st.error("No data available. Please check data files.")
         return
     
     if st.session_state.view_mode == 'biobank':
-        render_biobank_view(match_scores)
+        render_biobank_view(dataset)
     else:
-        render_request_view(match_scores)
+        render_request_view(dataset)
     
     # Footer with session info (for debugging)
     with st.sidebar:
         st.caption(f"Session: {st.session_state.session_id[:8]}...")
+        st.caption(f"Data version: {dataset.version}")
+        frame_bytes = match_scores.attrs.get('frame_bytes', 0)
+        object_bytes = match_scores.attrs.get('object_frame_bytes', 0)
+        if frame_bytes:
+            st.caption(
+                f"Match data: {frame_bytes / 1e6:.1f} MB in memory "
+                f"({object_bytes / 1e6:.1f} MB as object dtypes)"
+            )
+        if get_ai_executor() is not None:
+            stats = get_ai_executor().stats()
+            latency = (
+                f", p50 {stats['latency_p50']:.1f}s / p95 {stats['latency_p95']:.1f}s"
+                if stats['latency_p50'] is not None else ""
+            )
+            st.caption(f"AI jobs: {stats['queued']} queued, {stats['running']} running{latency}")
+            if get_upstream_guard().breaker.is_open():
+                st.caption("AI service: degraded, showing cached or rule-based answers")
         if st.button("Download Feedback Data"):
             if os.path.exists('feedback_data.csv'):
                 df = pd.read_csv('feedback_data.csv')
@@ -1006,6 +1264,11 @@ def main():
                     file_name=f"feedback_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
                     mime="text/csv"
                 )
+    
+    # AI jobs run on the executor thread; rerun until this session's are done
+    if has_pending_ai_jobs():
+        time.sleep(AI_POLL_SECONDS)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,551 @@
+"""
+LeadScore engine for the Biobank Viewer
+Computes s_disease, s_sample_type and s_sample_format for every
+(biobank, request) pair from the comma-separated entity fields.
+
+Each field is encoded as a sparse term matrix over the biobank-side
+vocabulary (one row per entity, one column per term), so term overlaps
+for a whole block of requests are a single sparse matrix product.
+Transposed, the biobank matrices are inverted indexes (term -> posting
+list of biobanks), which is how candidate pairs are generated when only
+pairs that reach a minimum disease score are wanted.
+
+Scoring rules:
+- s_disease: 6 if a request disease term is in the biobank's diseases,
+  else 4 if a request category is in the biobank's categories, else 2 if
+  the biobank specialty is a general hospital, else 0
+- s_sample_type / s_sample_format: 2 if the biobank offers every requested
+  term, 1 if it offers some, 0 if none or nothing was requested
+- LeadScore = s_disease + s_sample_type + s_sample_format
+
+Request categories come from an r_category column when the request table
+has one. A pair file without it (the enriched pair CSV) gets each
+request's categories rebuilt from the disease_matched_category of its
+pairs, which reproduces every category-tier score the file holds; with
+neither the category tier cannot fire and the CLI warns.
+
+The CLI shards the requests across worker processes. Each worker scores
+its shard against one read-only biobank encoding (inherited from the
+parent where the platform forks) and writes one Parquet part; the parts
+directory is swapped in whole and match_store reads it as one dataset.
+By default only pairs the app shows (s_disease >= MIN_DISEASE_SCORE) are
+written, scored from the inverted-index candidates; --brute-force scores
+the full cross product instead. With --pairs the regenerated scores are
+compared with the source file's before the parts are swapped in, and any
+difference aborts the run unless --allow-mismatch is given.
+
+Usage:
+    python lead_score.py --pairs data/pair_scores_enriched.csv      # -> data/pair_scores_parts/
+    python lead_score.py --biobanks b.csv --requests r.csv --workers 32
+    python lead_score.py --pairs in.csv --out out.csv               # single CSV, one process
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from scipy import sparse
+
+from match_store import MATCH_PARTS_DIR, MATCH_STORE_PATH, MIN_DISEASE_SCORE, SCORE_COLUMNS
+
+NOT_SPECIFIED = 'Not specified'
+GENERAL_HOSPITAL = 'general hospital'
+
+DISEASE_EXACT_SCORE = 6.0
+DISEASE_CATEGORY_SCORE = 4.0
+DISEASE_GENERAL_SCORE = 2.0
+SAMPLE_FULL_SCORE = 2.0
+SAMPLE_PARTIAL_SCORE = 1.0
+
+# Entity attribute columns carried into the pair output
+BIOBANK_COLUMNS = [
+    'biobank_name', 'b_disease', 'b_category', 'biobank_specialty',
+    'b_sample_type', 'b_sample_format', 'b_country', 'b_collaboration', 'b_prospective',
+    'b_post_content', 'b_clinical_information', 'b_research_services', 'b_certifications',
+]
+REQUEST_COLUMNS = [
+    'post_title', 'r_disease', 'r_category', 'r_sample_type', 'r_sample_format',
+    'r_country', 'r_collaboration', 'r_prospective',
+    'r_post_content', 'r_no_cases', 'r_data_required', 'r_inclusion_criteria', 'r_exclusion_criteria',
+]
+
+# (request field, biobank field) pairs encoded as term matrices
+TERM_FIELDS = {
+    'disease': ('r_disease', 'b_disease'),
+    'category': ('r_category', 'b_category'),
+    'sample_type': ('r_sample_type', 'b_sample_type'),
+    'sample_format': ('r_sample_format', 'b_sample_format'),
+}
+
+# Requests scored per sparse product; bounds the dense score block size
+SCORE_BLOCK_ROWS = 2048
+
+
+def split_terms(value):
+    """Normalised term set of one comma-separated cell"""
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NA:
+        return []
+    terms = []
+    for term in str(value).split(','):
+        term = term.strip()
+        if term and term != NOT_SPECIFIED and term.casefold() not in terms:
+            terms.append(term.casefold())
+    return terms
+
+
+def _column(df, name):
+    """A column of the entity table, or an all-missing one"""
+    return df[name] if name in df else pd.Series([None] * len(df), index=df.index)
+
+
+def build_vocabulary(values):
+    """Sorted term -> column mapping, plus the first spelling seen of each term"""
+    spellings = {}
+    for value in values:
+        if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NA:
+            continue
+        for term in str(value).split(','):
+            term = term.strip()
+            if term and term != NOT_SPECIFIED:
+                spellings.setdefault(term.casefold(), term)
+    terms = sorted(spellings)
+    return {term: i for i, term in enumerate(terms)}, [spellings[t] for t in terms]
+
+
+def encode_terms(values, vocabulary):
+    """CSR matrix with a 1 where an entity has a vocabulary term; also raw term counts"""
+    indptr = [0]
+    indices = []
+    counts = []
+    for value in values:
+        terms = split_terms(value)
+        counts.append(len(terms))
+        indices.extend(vocabulary[t] for t in terms if t in vocabulary)
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+        shape=(len(indptr) - 1, len(vocabulary)),
+    )
+    return matrix, np.array(counts, dtype=np.int32)
+
+
+class BiobankEncoding:
+    """Biobank term matrices and vocabularies, built once and reused for every request block"""
+
+    def __init__(self, biobanks):
+        self.biobanks = biobanks.reset_index(drop=True)
+        self.vocabularies = {}
+        self.spellings = {}
+        self.terms = {}
+        self.postings = {}
+        for field, (_, b_field) in TERM_FIELDS.items():
+            values = _column(self.biobanks, b_field)
+            self.vocabularies[field], self.spellings[field] = build_vocabulary(values)
+            # biobank x term rows for per-pair overlaps; term x biobank posting lists for products
+            self.terms[field] = encode_terms(values, self.vocabularies[field])[0]
+            self.postings[field] = self.terms[field].T.tocsr()
+
+        specialty = _column(self.biobanks, 'biobank_specialty').fillna('').astype(str).str.casefold()
+        self.general_hospital = specialty.str.contains(GENERAL_HOSPITAL, regex=False).to_numpy()
+        self.general_biobanks = np.flatnonzero(self.general_hospital)
+
+    def __len__(self):
+        return len(self.biobanks)
+
+    def encode_requests(self, requests):
+        """Term matrices of a request table against this biobank vocabulary"""
+        encoded = {}
+        for field, (r_field, _) in TERM_FIELDS.items():
+            encoded[field] = encode_terms(_column(requests, r_field), self.vocabularies[field])
+        return encoded
+
+
+def _sample_score(hits, requested):
+    """2 if every requested term is offered, 1 if some are, 0 otherwise"""
+    return np.where(
+        (requested > 0) & (hits >= requested), SAMPLE_FULL_SCORE,
+        np.where(hits > 0, SAMPLE_PARTIAL_SCORE, 0.0),
+    ).astype(np.float32)
+
+
+def _disease_score(disease_hits, category_hits, general_hospital):
+    """6 / 4 / 2 / 0 disease tier from the overlap counts"""
+    return np.where(
+        disease_hits > 0, DISEASE_EXACT_SCORE,
+        np.where(category_hits > 0, DISEASE_CATEGORY_SCORE,
+                 np.where(general_hospital, DISEASE_GENERAL_SCORE, 0.0)),
+    ).astype(np.float32)
+
+
+def _scores(s_disease, s_sample_type, s_sample_format):
+    """Named score arrays plus their LeadScore sum"""
+    return {
+        's_disease': s_disease,
+        's_sample_type': s_sample_type,
+        's_sample_format': s_sample_format,
+        'LeadScore': s_disease + s_sample_type + s_sample_format,
+    }
+
+
+def score_block(encoded_requests, encoding):
+    """Dense (requests x biobanks) score arrays for one block of encoded requests"""
+    def hits(field):
+        return (encoded_requests[field][0] @ encoding.postings[field]).toarray()
+
+    return _scores(
+        _disease_score(hits('disease'), hits('category'), encoding.general_hospital[None, :]),
+        _sample_score(hits('sample_type'), encoded_requests['sample_type'][1][:, None]),
+        _sample_score(hits('sample_format'), encoded_requests['sample_format'][1][:, None]),
+    )
+
+
+def candidate_pairs(encoded_requests, encoding):
+    """(request, biobank) pairs that can reach s_disease >= 2, from the posting lists
+
+    A pair is a candidate when it shares a disease term or a category, or
+    the biobank is a general hospital; every other pair scores 0 on disease.
+    Pairs come back ordered by request then biobank, like np.nonzero.
+    """
+    shared = (
+        encoded_requests['disease'][0] @ encoding.postings['disease']
+        + encoded_requests['category'][0] @ encoding.postings['category']
+    ).tocoo()
+    n_requests = shared.shape[0]
+    general = encoding.general_biobanks
+
+    request_idx = np.concatenate([shared.row, np.repeat(np.arange(n_requests), len(general))])
+    biobank_idx = np.concatenate([shared.col, np.tile(general, n_requests)])
+    keys = np.unique(request_idx.astype(np.int64) * len(encoding) + biobank_idx)
+    return keys // len(encoding), keys % len(encoding)
+
+
+def _pair_hits(encoded_requests, encoding, field, request_idx, biobank_idx):
+    """Term overlap count of each listed (request, biobank) pair"""
+    shared = encoded_requests[field][0][request_idx].multiply(encoding.terms[field][biobank_idx])
+    return np.asarray(shared.sum(axis=1)).ravel()
+
+
+def score_pairs(encoded_requests, encoding, request_idx, biobank_idx):
+    """Score arrays for the listed (request, biobank) pairs only"""
+    def hits(field):
+        return _pair_hits(encoded_requests, encoding, field, request_idx, biobank_idx)
+
+    return _scores(
+        _disease_score(hits('disease'), hits('category'), encoding.general_hospital[biobank_idx]),
+        _sample_score(hits('sample_type'), encoded_requests['sample_type'][1][request_idx]),
+        _sample_score(hits('sample_format'), encoded_requests['sample_format'][1][request_idx]),
+    )
+
+
+def matched_categories(request_categories, encoding, request_idx, biobank_idx):
+    """Alphabetically first shared category for each scored pair ('' if none)"""
+    shared = request_categories[request_idx].multiply(encoding.terms['category'][biobank_idx]).tocsr()
+    names = np.array(encoding.spellings['category'] + [''], dtype=object)
+    # Sorted vocabulary: the smallest column index is the first category
+    first = np.full(shared.shape[0], len(names) - 1)
+    has_any = np.diff(shared.indptr) > 0
+    first[has_any] = shared.indices[shared.indptr[:-1][has_any]]
+    return names[first]
+
+
+def pair_frame(requests, encoding, request_idx, biobank_idx, scores, request_categories):
+    """Assemble scored pairs with the request and biobank context columns"""
+    request_part = requests.reindex(columns=[c for c in REQUEST_COLUMNS if c in requests]).iloc[request_idx]
+    biobank_part = encoding.biobanks.reindex(
+        columns=[c for c in BIOBANK_COLUMNS if c in encoding.biobanks]
+    ).iloc[biobank_idx]
+
+    pairs = pd.concat([
+        biobank_part.reset_index(drop=True),
+        request_part.reset_index(drop=True),
+    ], axis=1)
+    for name, values in scores.items():
+        pairs[name] = values
+    pairs['disease_matched_category'] = np.where(
+        scores['s_disease'] == DISEASE_CATEGORY_SCORE,
+        matched_categories(request_categories, encoding, request_idx, biobank_idx),
+        '',
+    )
+    return pairs
+
+
+def score_all_pairs(requests, encoding, min_disease_score=None, brute_force=False):
+    """Score (biobank, request) pairs block by block
+
+    With a positive min_disease_score only candidate pairs from the
+    inverted indexes are scored; brute_force scores the full cross product
+    instead and gives the same output.
+    """
+    requests = requests.reset_index(drop=True)
+    use_candidates = not brute_force and min_disease_score is not None and min_disease_score > 0
+    frames = []
+    for start in range(0, len(requests), SCORE_BLOCK_ROWS):
+        block = requests.iloc[start:start + SCORE_BLOCK_ROWS]
+        encoded = encoding.encode_requests(block)
+
+        if use_candidates:
+            request_idx, biobank_idx = candidate_pairs(encoded, encoding)
+            scores = score_pairs(encoded, encoding, request_idx, biobank_idx)
+            keep = scores['s_disease'] >= min_disease_score
+            request_idx, biobank_idx = request_idx[keep], biobank_idx[keep]
+            scores = {name: values[keep] for name, values in scores.items()}
+        else:
+            scores = score_block(encoded, encoding)
+            keep = np.ones(scores['s_disease'].shape, dtype=bool)
+            if min_disease_score is not None:
+                keep = scores['s_disease'] >= min_disease_score
+            request_idx, biobank_idx = np.nonzero(keep)
+            scores = {name: values[request_idx, biobank_idx] for name, values in scores.items()}
+
+        frames.append(pair_frame(block, encoding, request_idx, biobank_idx, scores, encoded['category'][0]))
+
+    if not frames:
+        return pd.DataFrame(columns=BIOBANK_COLUMNS + REQUEST_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def score_request(request, encoding):
+    """Score one ad-hoc request against every biobank, best matches first
+
+    request maps request columns (r_disease, r_sample_type, ...) to their
+    comma-separated values; ties keep the biobank order.
+    """
+    requests = pd.DataFrame([request])
+    encoded = encoding.encode_requests(requests)
+    scores = score_block(encoded, encoding)
+    biobank_idx = np.arange(len(encoding))
+    request_idx = np.zeros(len(encoding), dtype=np.int64)
+    pairs = pair_frame(
+        requests, encoding, request_idx, biobank_idx,
+        {name: values[0] for name, values in scores.items()},
+        encoded['category'][0],
+    )
+    order = np.argsort(-pairs['LeadScore'].to_numpy(), kind='stable')
+    return pairs.iloc[order].reset_index(drop=True)
+
+
+def read_biobank_table(store_path=MATCH_STORE_PATH):
+    """One row of attributes per biobank, read batch by batch from the Parquet store"""
+    parquet = pq.ParquetFile(store_path)
+    columns = [c for c in BIOBANK_COLUMNS if c in parquet.schema_arrow.names]
+    frames = []
+    seen = set()
+    for batch in parquet.iter_batches(columns=columns):
+        frame = batch.to_pandas().drop_duplicates('biobank_name')
+        frame = frame[~frame['biobank_name'].isin(seen)]
+        seen.update(frame['biobank_name'])
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def categories_from_pairs(pairs):
+    """Each request's categories, from the categories its pairs matched on
+
+    A category-tier pair records the first category the request shares
+    with the biobank, so the union over a request's pairs contains every
+    category that decides a score; categories that never matched alone
+    cannot change one.
+    """
+    matched = pairs[['post_title', 'disease_matched_category']].dropna()
+    matched = matched[matched['disease_matched_category'] != '']
+    return matched.groupby('post_title')['disease_matched_category'].agg(lambda v: ",".join(sorted(set(v))))
+
+
+def entities_from_pairs(pairs):
+    """Recover the biobank and request tables from an existing pair file"""
+    biobanks = pairs[[c for c in BIOBANK_COLUMNS if c in pairs]].drop_duplicates('biobank_name')
+    requests = pairs[[c for c in REQUEST_COLUMNS if c in pairs]].drop_duplicates('post_title')
+    if 'r_category' not in requests and 'disease_matched_category' in pairs:
+        requests = requests.assign(
+            r_category=requests['post_title'].map(categories_from_pairs(pairs)).fillna(NOT_SPECIFIED)
+        )
+    return biobanks.reset_index(drop=True), requests.reset_index(drop=True)
+
+
+# Biobank encoding of a worker process; set in the parent before forking
+_worker_encoding = None
+
+
+def _init_worker(biobanks):
+    """Build the biobank encoding in a worker that did not inherit one"""
+    global _worker_encoding
+    if _worker_encoding is None:
+        _worker_encoding = BiobankEncoding(biobanks)
+
+
+def write_part(pairs, path):
+    """Write scored pairs as one Parquet part with a fixed string/float schema"""
+    schema = pa.schema([
+        (name, pa.float64() if name in SCORE_COLUMNS else pa.string())
+        for name in pairs.columns
+    ])
+    pq.write_table(pa.Table.from_pandas(pairs, schema=schema, preserve_index=False), path, compression='zstd')
+
+
+def _score_shard(shard, requests, parts_dir, min_disease_score, brute_force):
+    """Score one request shard in a worker and write its part file"""
+    pairs = score_all_pairs(requests, _worker_encoding, min_disease_score, brute_force)
+    write_part(pairs, os.path.join(parts_dir, f"part-{shard:05d}.parquet"))
+    return len(pairs)
+
+
+def compare_scores(pairs, reference, min_disease_score=None):
+    """Differences between regenerated pair scores and those of a source pair table
+
+    Returns one line per problem; an empty list means the pair sets and
+    every score column present in the reference agree.
+    """
+    keys = ['biobank_name', 'post_title']
+    columns = [c for c in SCORE_COLUMNS if c in reference]
+    reference = reference[keys + columns].drop_duplicates(keys).copy()
+    for column in columns:
+        reference[column] = pd.to_numeric(reference[column], errors='coerce')
+    if min_disease_score is not None and 's_disease' in reference:
+        reference = reference[reference['s_disease'] >= min_disease_score]
+
+    merged = pairs[keys + columns].merge(reference, on=keys, how='outer', suffixes=('', '_source'), indicator=True)
+    problems = []
+    sides = {'right_only': "source pairs not regenerated", 'left_only': "regenerated pairs not in the source"}
+    for side, label in sides.items():
+        count = int((merged['_merge'] == side).sum())
+        if count:
+            problems.append(f"{count:,} {label}")
+
+    both = merged[merged['_merge'] == 'both']
+    for column in columns:
+        regenerated = both[column].to_numpy(dtype=float)
+        source = both[f"{column}_source"].to_numpy(dtype=float)
+        differ = ~np.isclose(regenerated, source, equal_nan=True)
+        if differ.any():
+            example = both[differ].iloc[0]
+            problems.append(
+                f"{int(differ.sum()):,} pairs differ on {column}, e.g. {example['biobank_name']!r} x "
+                f"{example['post_title']!r}: {example[column]:g} vs {example[f'{column}_source']:g} in the source"
+            )
+    return problems
+
+
+def read_parts(parts_dir, columns=None):
+    """All Parquet parts of a directory as one DataFrame"""
+    return ds.dataset(parts_dir, format='parquet').to_table(columns=columns).to_pandas()
+
+
+def write_sharded_pairs(requests, biobanks, parts_dir=MATCH_PARTS_DIR, workers=None, shards=None,
+                        min_disease_score=MIN_DISEASE_SCORE, brute_force=False, reference=None,
+                        allow_mismatch=False):
+    """Score all pairs across worker processes, one Parquet part per request shard
+
+    With a reference pair table the new parts are compared with its scores
+    first; differences raise ValueError and leave parts_dir untouched
+    unless allow_mismatch, in which case they are only reported.
+    """
+    global _worker_encoding
+    workers = workers or os.cpu_count() or 1
+    shards = shards or workers
+    requests = requests.reset_index(drop=True)
+
+    tmp_dir = f"{parts_dir}.{os.getpid()}.tmp"
+    os.makedirs(tmp_dir)
+
+    # Forked workers share the parent's encoding pages instead of rebuilding it
+    context = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        _worker_encoding = BiobankEncoding(biobanks)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(biobanks,)) as pool:
+            futures = [
+                pool.submit(_score_shard, shard, requests.iloc[rows], tmp_dir, min_disease_score, brute_force)
+                for shard, rows in enumerate(np.array_split(np.arange(len(requests)), shards))
+                if len(rows)
+            ]
+            total = sum(future.result() for future in futures)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    finally:
+        _worker_encoding = None
+
+    if reference is not None:
+        columns = ['biobank_name', 'post_title'] + SCORE_COLUMNS
+        problems = compare_scores(read_parts(tmp_dir, columns), reference, min_disease_score)
+        if problems:
+            report = "Regenerated scores differ from the source pairs:\n  " + "\n  ".join(problems)
+            if not allow_mismatch:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise ValueError(report)
+            print(report, file=sys.stderr)
+
+    # Swap the whole directory so the loader never sees a partial set of parts
+    old_dir = f"{parts_dir}.{os.getpid()}.old"
+    if os.path.exists(parts_dir):
+        os.replace(parts_dir, old_dir)
+    os.replace(tmp_dir, parts_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute LeadScores for every biobank x request pair")
+    parser.add_argument('--biobanks', help="CSV of biobank attributes")
+    parser.add_argument('--requests', help="CSV of request attributes")
+    parser.add_argument('--pairs', help="Existing pair CSV to take the entity tables from")
+    parser.add_argument('--parts-dir', default=MATCH_PARTS_DIR, help="Destination directory of Parquet parts")
+    parser.add_argument('--out', help="Write a single CSV from one process instead of Parquet parts")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--shards', type=int, default=None, help="Request shards / part files (default: workers)")
+    parser.add_argument('--min-disease-score', type=float, default=MIN_DISEASE_SCORE,
+                        help=f"Only write pairs with s_disease at or above this (default: {MIN_DISEASE_SCORE:g}, "
+                             "the app's threshold; 0 writes every pair)")
+    parser.add_argument('--brute-force', action='store_true',
+                        help="Score the full cross product instead of indexed candidates (same output)")
+    parser.add_argument('--allow-mismatch', action='store_true',
+                        help="Swap in the parts even when their scores differ from --pairs")
+    args = parser.parse_args()
+
+    reference = None
+    if args.pairs:
+        reference = pd.read_csv(args.pairs, dtype=str)
+        biobanks, requests = entities_from_pairs(reference)
+    elif args.biobanks and args.requests:
+        biobanks, requests = pd.read_csv(args.biobanks, dtype=str), pd.read_csv(args.requests, dtype=str)
+    else:
+        parser.error("pass --pairs, or both --biobanks and --requests")
+
+    if 'r_category' not in requests:
+        print("Warning: the requests have no r_category column, so no pair can reach the "
+              f"category tier (s_disease {DISEASE_CATEGORY_SCORE:g})", file=sys.stderr)
+
+    started = time.perf_counter()
+    if args.out:
+        pairs = score_all_pairs(requests, BiobankEncoding(biobanks), args.min_disease_score, args.brute_force)
+        if reference is not None:
+            for problem in compare_scores(pairs, reference, args.min_disease_score):
+                print(f"Warning: {problem}", file=sys.stderr)
+        pairs.to_csv(args.out, index=False)
+        print(f"Wrote {len(pairs):,} pairs to {args.out} in {time.perf_counter() - started:.1f}s")
+        return
+
+    try:
+        rows = write_sharded_pairs(requests, biobanks, args.parts_dir, args.workers, args.shards,
+                                   args.min_disease_score, args.brute_force, reference, args.allow_mismatch)
+    except ValueError as e:
+        sys.exit(f"{e}\n{args.parts_dir} was left unchanged; pass --allow-mismatch to replace it anyway")
+    print(f"Wrote {rows:,} pairs to {args.parts_dir} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Live match dataset for the Biobank Viewer
+A MatchDataset is an immutable snapshot of the view table with its row
+indexes and summaries. MatchDataWatcher keeps one per process, polls the
+source files, builds a replacement off the request path when they change
+and swaps it in with a single reference assignment. Each script run takes
+one snapshot, so a session keeps its version until its next rerun.
+
+Small changes arrive as delta files in data/pair_scores_delta/. They are
+merged into a new snapshot that shares the memory-mapped base table; only
+the indexes and summaries of the entities they touch are recomputed. An
+upsert replaces the whole row, so a delta that lacks view columns or scores
+is rejected, and retried once the file changes. The watcher periodically
+compacts pending deltas into the Parquet store.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from match_display import build_display_columns
+from match_store import (
+    DELTA_DIR,
+    DELTA_OP_COLUMN,
+    MATCH_CSV_PATH,
+    MATCH_PARTS_DIR,
+    MATCH_STORE_PATH,
+    MATCH_TABLE_PATH,
+    MIN_DISEASE_SCORE,
+    SCORE_COLUMNS,
+    STORE_ROW_COLUMN,
+    build_entity_summary,
+    build_match_index,
+    combine_deltas,
+    compact_store,
+    ensure_match_table,
+    list_delta_files,
+    normalize_delta,
+    open_match_table,
+    read_delta_file,
+    read_match_details,
+)
+
+logger = logging.getLogger(__name__)
+
+# Entity columns that get a row index and a summary table
+ENTITY_KEYS = ['biobank_name', 'post_title']
+
+# How often the watcher checks the source files for a new version
+RELOAD_POLL_SECONDS = 30
+
+# How often the watcher looks for new delta files
+DELTA_POLL_SECONDS = 2
+
+# Pending deltas are folded into the Parquet store this often
+COMPACT_INTERVAL_SECONDS = 60 * 60
+
+# Sibling of the delta files; compacted deltas are moved here
+APPLIED_DELTA_DIR = 'applied'
+
+# A compaction lock older than this was left by a crashed process
+COMPACT_LOCK_STALE_SECONDS = 30 * 60
+
+
+class MatchDataset:
+    """Immutable snapshot of the match table with its indexes and summaries"""
+
+    def __init__(self, frame, version, delta=None, indexes=None, summaries=None, delta_details=None,
+                 base_version=None, delta_batches=0):
+        self.frame = frame
+        self.version = version
+        self.base_version = base_version or version
+        self.delta_batches = delta_batches
+        # Rows added by deltas; offsets past the end of frame point in here
+        self.delta = delta if delta is not None else frame.iloc[0:0]
+        self.delta_details = delta_details if delta_details is not None else {}
+        if indexes is None:
+            indexes = {key: build_match_index(frame, key) for key in ENTITY_KEYS}
+        if summaries is None:
+            summaries = {key: build_entity_summary(frame, key) for key in ENTITY_KEYS}
+        self.indexes = indexes
+        self.summaries = summaries
+
+    def _split(self, positions):
+        """Partition row offsets into base and delta parts, plus the restoring order"""
+        positions = np.asarray(positions, dtype=np.int64)
+        in_base = positions < len(self.frame)
+        order = np.argsort(
+            np.concatenate([np.flatnonzero(in_base), np.flatnonzero(~in_base)]),
+            kind='stable',
+        )
+        return positions[in_base], positions[~in_base] - len(self.frame), order
+
+    def take(self, positions):
+        """Rows at the given offsets, in the given order"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(self.delta) == 0 or (positions < len(self.frame)).all():
+            return self.frame.iloc[positions]
+        base, delta, order = self._split(positions)
+        return pd.concat([self.frame.iloc[base], self.delta.iloc[delta]]).iloc[order]
+
+    def column(self, name, positions):
+        """Values of one column at the given offsets, as a NumPy array"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(self.delta) == 0 or (positions < len(self.frame)).all():
+            return self.frame[name].iloc[positions].to_numpy()
+        base, delta, order = self._split(positions)
+        values = pd.concat([self.frame[name].iloc[base], self.delta[name].iloc[delta]], ignore_index=True)
+        return values.iloc[order].to_numpy()
+
+    def exclude(self, positions, exclusions):
+        """Drop offsets whose label columns take any of the excluded values"""
+        keep = np.ones(len(positions), dtype=bool)
+        for column, values in exclusions.items():
+            if values:
+                keep &= ~pd.Series(self.column(column, positions)).isin(values).to_numpy()
+        return positions[keep]
+
+    def match_details(self, biobank_name, request_title, store_row=None):
+        """Free-text context of one pair, from the delta if it changed there
+
+        store_row is the row's STORE_ROW_COLUMN value; base rows have one,
+        so only their row group is read instead of searching the store.
+        """
+        key = (biobank_name, request_title)
+        if key in self.delta_details:
+            return self.delta_details[key]
+        if not os.path.exists(MATCH_STORE_PATH):
+            return {}
+        # Rows added by deltas have no store row
+        store_row = None if store_row is None or pd.isna(store_row) else int(store_row)
+        return read_match_details(biobank_name, request_title, store_row=store_row)
+
+    def entity_table(self, key, columns):
+        """One row per entity, taken from its top-ranked current row
+
+        Only columns of the view are available; categoricals come back as
+        plain object columns.
+        """
+        index = self.indexes[key]
+        positions = np.fromiter((positions[0] for positions in index.values()), dtype=np.int64, count=len(index))
+        rows = self.take(positions)
+        rows = rows[[c for c in columns if c in rows]].reset_index(drop=True)
+        return rows.astype({c: object for c in rows if isinstance(rows[c].dtype, pd.CategoricalDtype)})
+
+    def biobank_details(self, biobank_name):
+        """Biobank-side free-text context, read from any one of its pairs"""
+        positions = self.indexes['biobank_name'].get(biobank_name)
+        if positions is None or len(positions) == 0:
+            return {}
+        first = positions[:1]
+        details = self.match_details(
+            biobank_name, self.column('post_title', first)[0], self.column(STORE_ROW_COLUMN, first)[0]
+        )
+        return {name: value for name, value in details.items() if name.startswith('b_')}
+
+    def _pair_positions(self, biobank_name, request_title):
+        """Current offsets of one (biobank, request) pair"""
+        positions = self.indexes['biobank_name'].get(biobank_name)
+        if positions is None or len(positions) == 0:
+            return positions if positions is not None else np.empty(0, dtype=np.int64)
+        return positions[self.column('post_title', positions) == request_title]
+
+    def apply_delta(self, delta, version=None):
+        """Return a new snapshot with a delta's upserts and deletes merged in"""
+        delta = combine_deltas([delta])
+        pairs = list(zip(delta['biobank_name'], delta['post_title']))
+
+        # Every current row of a touched pair leaves the view
+        removed = [self._pair_positions(b, t) for b, t in pairs]
+        removed = np.concatenate(removed) if removed else np.empty(0, dtype=np.int64)
+
+        # Upserts that clear the relevance filter become new delta rows
+        upserts = delta[delta[DELTA_OP_COLUMN] == 'upsert']
+        if 's_disease' in upserts:
+            visible = upserts[pd.to_numeric(upserts['s_disease'], errors='coerce') >= MIN_DISEASE_SCORE]
+        else:
+            visible = upserts.iloc[0:0]
+        rows = visible.drop(columns=[DELTA_OP_COLUMN]).reset_index(drop=True)
+        for column in SCORE_COLUMNS:
+            if column in rows:
+                rows[column] = rows[column].astype(float)
+        rows = pd.concat([rows, build_display_columns(rows).reset_index(drop=True)], axis=1)
+        rows = rows.reindex(columns=self.frame.columns)
+
+        start = len(self.frame) + len(self.delta)
+        added = np.arange(start, start + len(rows), dtype=np.int64)
+        merged_delta = pd.concat([self.delta, rows], ignore_index=True) if len(rows) else self.delta
+
+        # Detail columns travel with the upsert; deletes hide stored details
+        delta_details = dict(self.delta_details)
+        detail_columns = [c for c in upserts.columns if c not in self.frame.columns and c != DELTA_OP_COLUMN]
+        for record in delta.to_dict('records'):
+            key = (record['biobank_name'], record['post_title'])
+            if record[DELTA_OP_COLUMN] == 'delete':
+                delta_details[key] = {}
+            elif detail_columns:
+                delta_details[key] = {c: record.get(c) for c in detail_columns}
+
+        dataset = MatchDataset(
+            self.frame,
+            version or f"{self.base_version} +{self.delta_batches + 1} deltas",
+            delta=merged_delta,
+            indexes={},
+            summaries={},
+            delta_details=delta_details,
+            base_version=self.base_version,
+            delta_batches=self.delta_batches + 1,
+        )
+
+        # Recompute index entries and summaries only for touched entities
+        for key in ENTITY_KEYS:
+            index = dict(self.indexes[key])
+            touched = set(delta[key])
+            new_values = rows[key].to_numpy()
+            for value in touched:
+                positions = index.get(value, np.empty(0, dtype=np.int64))
+                positions = positions[~np.isin(positions, removed)]
+                positions = np.concatenate([positions, added[new_values == value]])
+                if len(positions) == 0:
+                    index.pop(value, None)
+                    continue
+                scores = dataset.column('LeadScore', positions).astype(np.float64)
+                index[value] = positions[np.argsort(-scores, kind='stable')]
+
+            if set(index) != set(self.indexes[key]):
+                index = dict(sorted(index.items()))
+            dataset.indexes[key] = index
+
+            touched_positions = [index[v] for v in touched if v in index]
+            summary = self.summaries[key].drop(list(touched), errors='ignore')
+            if touched_positions:
+                touched_positions = np.concatenate(touched_positions)
+                touched_frame = pd.DataFrame({
+                    key: dataset.column(key, touched_positions),
+                    'LeadScore': dataset.column('LeadScore', touched_positions).astype(np.float64),
+                })
+                summary = pd.concat([summary, build_entity_summary(touched_frame, key)]).sort_index()
+            dataset.summaries[key] = summary
+
+        return dataset
+
+
+def source_signature(csv_path=MATCH_CSV_PATH, store_path=MATCH_STORE_PATH, parts_dir=MATCH_PARTS_DIR):
+    """Modification time and size of each source file that exists"""
+    signature = []
+    for path in (csv_path, parts_dir, store_path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def load_dataset(csv_path=MATCH_CSV_PATH, store_path=MATCH_STORE_PATH, table_path=MATCH_TABLE_PATH,
+                 parts_dir=MATCH_PARTS_DIR):
+    """Compile the sources as needed and build a full dataset snapshot"""
+    table_path = ensure_match_table(csv_path, store_path, table_path, parts_dir)
+    modified = os.path.getmtime(table_path)
+    version = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(modified)) + f".{int(modified * 1000) % 1000:03d}"
+    return MatchDataset(open_match_table(table_path), version)
+
+
+class MatchDataWatcher:
+    """Process-wide holder that hot-reloads the dataset when the sources change"""
+
+    def __init__(self, csv_path=MATCH_CSV_PATH, store_path=MATCH_STORE_PATH,
+                 table_path=MATCH_TABLE_PATH, delta_dir=DELTA_DIR,
+                 poll_seconds=RELOAD_POLL_SECONDS, delta_poll_seconds=DELTA_POLL_SECONDS,
+                 compact_seconds=COMPACT_INTERVAL_SECONDS, parts_dir=MATCH_PARTS_DIR):
+        self.csv_path = csv_path
+        self.parts_dir = parts_dir
+        self.store_path = store_path
+        self.table_path = table_path
+        self.delta_dir = delta_dir
+        self.poll_seconds = poll_seconds
+        self.delta_poll_seconds = delta_poll_seconds
+        self.compact_seconds = compact_seconds
+
+        self._dataset = None
+        self._signature = None
+        self._applied_deltas = []
+        # Rejected delta files -> their (mtime, size) when they failed
+        self._failed_deltas = {}
+        self._lock = threading.Lock()
+
+        # Load the first version synchronously; later ones in the background
+        self.reload()
+
+        self._thread = threading.Thread(target=self._watch, name="match-data-watcher", daemon=True)
+        self._thread.start()
+
+    def current(self):
+        """The latest complete dataset, or None if no source exists yet"""
+        return self._dataset
+
+    def reload(self, force=False):
+        """Rebuild and swap in the dataset if the sources changed; True if swapped"""
+        with self._lock:
+            signature = source_signature(self.csv_path, self.store_path, self.parts_dir)
+            if not signature or (signature == self._signature and not force):
+                return False
+
+            try:
+                dataset = load_dataset(self.csv_path, self.store_path, self.table_path, self.parts_dir)
+            except Exception:
+                # Keep serving the previous version, e.g. while a file is still being copied
+                logger.exception("Match data reload failed; keeping version %s",
+                                 self._dataset.version if self._dataset else None)
+                return False
+
+            # A single reference assignment: readers see the old or the new
+            # snapshot, never a partially built one. Record the signature
+            # after the build, which itself rewrites the compiled store.
+            self._dataset = dataset
+            self._signature = source_signature(self.csv_path, self.store_path, self.parts_dir)
+            self._applied_deltas = []
+            logger.info("Match data version %s loaded (%s rows)", dataset.version, f"{len(dataset.frame):,}")
+
+        # Deltas not yet compacted still apply on top of the new base
+        self.ingest_deltas()
+        return True
+
+    def ingest_delta(self, delta, name=None):
+        """Merge an in-memory delta frame into the current dataset"""
+        with self._lock:
+            if self._dataset is None:
+                raise RuntimeError("No match data loaded to apply a delta to")
+            delta = normalize_delta(delta, name or "<memory>")
+            started = time.perf_counter()
+            self._dataset = self._dataset.apply_delta(delta)
+            if name:
+                self._applied_deltas.append(name)
+            logger.info("Applied delta %s (%s rows) in %.1f ms", name or "<memory>",
+                        f"{len(delta):,}", (time.perf_counter() - started) * 1000)
+
+    def ingest_deltas(self):
+        """Apply delta files that appeared, or were fixed, since the last check"""
+        for path in list_delta_files(self.delta_dir):
+            if path in self._applied_deltas:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            # A rejected file is retried once it has been rewritten
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self._failed_deltas.get(path) == signature:
+                continue
+            try:
+                self.ingest_delta(read_delta_file(path), name=path)
+            except Exception:
+                logger.exception("Could not apply delta %s; skipping it until it changes", path)
+                self._failed_deltas[path] = signature
+            else:
+                self._failed_deltas.pop(path, None)
+
+    def _acquire_compact_lock(self, lock_path):
+        """Lock file descriptor, or None while another process is compacting"""
+        for _ in range(2):
+            try:
+                return os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                pass
+            # A crashed compaction never removes its lock; take over stale ones
+            try:
+                age = time.time() - os.path.getmtime(lock_path)
+            except FileNotFoundError:
+                continue
+            if age < COMPACT_LOCK_STALE_SECONDS:
+                return None
+            logger.warning("Removing compaction lock %s left %.0f s ago", lock_path, age)
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+        return None
+
+    def compact(self):
+        """Fold applied delta files into the Parquet store and reload"""
+        paths = [p for p in self._applied_deltas if os.path.exists(p)]
+        if not paths:
+            return False
+
+        # Only one worker process may compact at a time
+        lock_path = f"{self.store_path}.compact.lock"
+        lock_fd = self._acquire_compact_lock(lock_path)
+        if lock_fd is None:
+            return False
+
+        try:
+            rows = compact_store(combine_deltas([read_delta_file(p) for p in paths]), self.store_path)
+            applied_dir = os.path.join(self.delta_dir, APPLIED_DELTA_DIR)
+            os.makedirs(applied_dir, exist_ok=True)
+            for path in paths:
+                shutil.move(path, os.path.join(applied_dir, os.path.basename(path)))
+            logger.info("Compacted %d delta files into %s (%s rows)", len(paths), self.store_path, f"{rows:,}")
+        finally:
+            os.close(lock_fd)
+            os.remove(lock_path)
+
+        return self.reload()
+
+    def _watch(self):
+        """Background loop polling the delta directory and the source files"""
+        last_reload_check = last_compact = time.monotonic()
+        while True:
+            time.sleep(self.delta_poll_seconds)
+            try:
+                self.ingest_deltas()
+                now = time.monotonic()
+                if now - last_compact >= self.compact_seconds:
+                    last_compact = now
+                    self.compact()
+                if now - last_reload_check >= self.poll_seconds:
+                    last_reload_check = now
+                    self.reload()
+            except Exception:
+                logger.exception("Match data watcher iteration failed")
@@ -0,0 +1,276 @@
+"""
+Display strings and compatibility labels for match rows
+Every label shown in the scoring breakdown is derived once per distinct
+combination of its input fields and broadcast to the whole frame as a
+categorical column, so rendering only reads precomputed values.
+The geographic label is computed for the whole frame at once from the
+country -> canonical name / region / regulatory bloc table in
+config/country_regions.csv; aliases such as UK and United Kingdom share a
+canonical name and count as the same country.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+NOT_SPECIFIED = 'Not specified'
+
+# Compatibility labels users can hide in the match lists
+COLLAB_LOGIC_VALUES = ["Flexible", "Check specifics", "Conflict", "Terms unclear", "Check compatibility"]
+PROSPECTIVE_LOGIC_VALUES = ["Cannot meet", "Conditional", "Aligned", "Unclear", "Compatible"]
+
+# Geographic labels, closest relationship first
+GEO_LOGIC_VALUES = [
+    "Same country", "Both in EU", "Both in EEA", "GDPR adequacy", "US-Canada",
+    "Cross-border (same region)", "Cross-border (different regions)", "Location unclear",
+]
+GEO_PROXIMITY = {label: rank for rank, label in enumerate(GEO_LOGIC_VALUES)}
+
+COUNTRY_REGIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config', 'country_regions.csv')
+
+# Regulatory blocs listed in the country table's semicolon-separated blocs column
+GEO_BLOCS = ['EU', 'EEA', 'GDPR adequacy', 'US-Canada']
+
+
+def load_country_regions(path=COUNTRY_REGIONS_PATH):
+    """Country -> canonical name and region plus one boolean column per regulatory bloc"""
+    table = pd.read_csv(path, dtype=str, keep_default_na=False).set_index('country')
+    blocs = table['blocs'].str.split(';')
+    for bloc in GEO_BLOCS:
+        table[bloc] = blocs.apply(lambda country_blocs: bloc in country_blocs)
+    return table.drop(columns=['blocs'])
+
+
+# Loaded once per process
+COUNTRY_REGIONS = load_country_regions()
+
+
+def _text(value, default=NOT_SPECIFIED):
+    """Normalise a missing cell to the default label"""
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return default
+    return str(value)
+
+
+def format_list(value):
+    """Space out a comma-separated field for display"""
+    value = _text(value)
+    if value == NOT_SPECIFIED:
+        return value
+    return value.replace(',', ', ')
+
+
+def format_caption_list(value):
+    """Comma-separated field for a caption; empty when unknown"""
+    value = _text(value, '')
+    if value == NOT_SPECIFIED:
+        return ''
+    return value.replace(',', ', ')
+
+
+def format_caption(value):
+    """Plain field for a caption; empty when unknown"""
+    value = _text(value, '')
+    return '' if value == NOT_SPECIFIED else value
+
+
+def disease_logic(disease_score, matched_category):
+    """Describe which disease tier produced the score"""
+    disease_score = float(disease_score) if _text(disease_score, '') else 0.0
+    if abs(disease_score - 6) < 0.1:
+        return "Exact match (6/6)"
+    elif abs(disease_score - 4) < 0.1:
+        matched_category = _text(matched_category, '')
+        if matched_category:
+            return f"Category: {matched_category} (4/6)"
+        return "Category match (4/6)"
+    elif abs(disease_score - 2) < 0.1:
+        return "General hospital (2/6)"
+    return f"No alignment ({disease_score:.1f}/6)"
+
+
+def _country_values(countries):
+    """Country cells as an object Series with missing values normalised"""
+    countries = pd.Series(np.asarray(countries, dtype=object))
+    return countries.where(countries.notna(), NOT_SPECIFIED)
+
+
+def geo_logic_column(r_countries, b_countries):
+    """Geographic relationship label of every pair, as a categorical"""
+    r_countries, b_countries = _country_values(r_countries), _country_values(b_countries)
+
+    def bloc(countries, name):
+        return countries.map(COUNTRY_REGIONS[name]).fillna(False).astype(bool).to_numpy()
+
+    # Countries missing from the table keep their own name
+    r_canonical = r_countries.map(COUNTRY_REGIONS['canonical']).fillna(r_countries)
+    b_canonical = b_countries.map(COUNTRY_REGIONS['canonical']).fillna(b_countries)
+    r_region = r_countries.map(COUNTRY_REGIONS['region'])
+    b_region = b_countries.map(COUNTRY_REGIONS['region'])
+    r_eea, b_eea = bloc(r_countries, 'EEA'), bloc(b_countries, 'EEA')
+
+    # First matching condition wins: an unknown country makes the location
+    # unclear, otherwise the closest relationship in GEO_LOGIC_VALUES order
+    conditions = [
+        ((r_countries == NOT_SPECIFIED) | (b_countries == NOT_SPECIFIED)).to_numpy(),
+        (r_canonical == b_canonical).to_numpy(),
+        bloc(r_countries, 'EU') & bloc(b_countries, 'EU'),
+        r_eea & b_eea,
+        (r_eea & bloc(b_countries, 'GDPR adequacy')) | (b_eea & bloc(r_countries, 'GDPR adequacy')),
+        bloc(r_countries, 'US-Canada') & bloc(b_countries, 'US-Canada'),
+        (r_region.notna() & (r_region == b_region)).to_numpy(),
+    ]
+    labels = [
+        "Location unclear", "Same country", "Both in EU", "Both in EEA", "GDPR adequacy",
+        "US-Canada", "Cross-border (same region)",
+    ]
+    values = np.select(conditions, labels, default="Cross-border (different regions)")
+    return pd.Categorical(values, categories=GEO_LOGIC_VALUES)
+
+
+def proximity_order(geo_labels):
+    """Stable order that puts geographically closer pairs first"""
+    ranks = pd.Series(np.asarray(geo_labels, dtype=object)).map(GEO_PROXIMITY).fillna(len(GEO_LOGIC_VALUES))
+    return np.argsort(ranks.to_numpy(), kind='stable')
+
+
+def request_collab_display(r_collaboration):
+    """Request collaboration preference with proper capitalization"""
+    r_collaboration = _text(r_collaboration)
+    return {
+        'fee-for-service': 'Fee-for-service',
+        'collaboration & co-publication': 'Collaboration & co-publication',
+        'open to discussion': 'Open to discussion',
+        'it depends': 'It depends',
+        'other': 'Other',
+    }.get(r_collaboration.lower(), r_collaboration)
+
+
+def biobank_collab_display(b_collaboration):
+    """Biobank collaboration requirement in the current terminology"""
+    b_collaboration = _text(b_collaboration, '')
+    return {
+        'Yes': 'Collaboration required',
+        'Yes if possible': 'Collaboration if possible',
+        'No': 'Collaboration not required',
+        'Sometimes': 'Collaboration sometimes required',
+    }.get(b_collaboration, b_collaboration or NOT_SPECIFIED)
+
+
+def collab_logic(r_collaboration, b_collaboration):
+    """Compatibility of collaboration terms"""
+    r_collaboration = _text(r_collaboration).lower()
+    b_collaboration = _text(b_collaboration, '')
+    if r_collaboration == 'open to discussion':
+        return "Flexible"
+    elif r_collaboration in ['it depends', 'other']:
+        return "Check specifics"
+    elif r_collaboration == 'fee-for-service' and b_collaboration == 'Yes':
+        return "Conflict"
+    elif r_collaboration == 'collaboration & co-publication' and b_collaboration == 'No':
+        return "Conflict"
+    elif b_collaboration in [NOT_SPECIFIED, '']:
+        return "Terms unclear"
+    return "Check compatibility"
+
+
+def request_prospective_display(r_prospective):
+    """Request prospective collection need"""
+    return {
+        'Yes': 'Requires prospective collection',
+        'No': 'Does not require prospective collection',
+    }.get(_text(r_prospective), NOT_SPECIFIED)
+
+
+def biobank_prospective_display(b_prospective):
+    """Biobank prospective collection capability"""
+    return {
+        'Yes': 'Can do prospective collection',
+        'No': 'Cannot do prospective collection',
+        'Sometimes': 'Can sometimes do prospective collection',
+    }.get(_text(b_prospective), NOT_SPECIFIED)
+
+
+def prospective_logic(r_prospective, b_prospective):
+    """Compatibility of prospective collection needs"""
+    r_prospective, b_prospective = _text(r_prospective), _text(b_prospective)
+    if r_prospective == 'Yes' and b_prospective == 'No':
+        return "Cannot meet"
+    elif r_prospective == 'Yes' and b_prospective == 'Sometimes':
+        return "Conditional"
+    elif r_prospective == b_prospective and r_prospective != NOT_SPECIFIED:
+        return "Aligned"
+    elif b_prospective == NOT_SPECIFIED or r_prospective == NOT_SPECIFIED:
+        return "Unclear"
+    return "Compatible"
+
+
+# Derived column -> (source columns, label function)
+DISPLAY_COLUMN_SPECS = {
+    'r_disease_display': (['r_disease'], format_list),
+    'b_disease_display': (['b_disease'], format_list),
+    'b_category_display': (['b_category'], format_caption_list),
+    'biobank_specialty_display': (['biobank_specialty'], format_caption),
+    'r_sample_type_display': (['r_sample_type'], format_list),
+    'b_sample_type_display': (['b_sample_type'], format_list),
+    'r_sample_format_display': (['r_sample_format'], format_list),
+    'b_sample_format_display': (['b_sample_format'], format_list),
+    'r_country_display': (['r_country'], _text),
+    'b_country_display': (['b_country'], _text),
+    'disease_logic': (['s_disease', 'disease_matched_category'], disease_logic),
+    'r_collab_display': (['r_collaboration'], request_collab_display),
+    'b_collab_display': (['b_collaboration'], biobank_collab_display),
+    'collab_logic': (['r_collaboration', 'b_collaboration'], collab_logic),
+    'r_prosp_display': (['r_prospective'], request_prospective_display),
+    'b_prosp_display': (['b_prospective'], biobank_prospective_display),
+    'prospective_logic': (['r_prospective', 'b_prospective'], prospective_logic),
+}
+
+# Derived column -> function of the whole frame
+FRAME_COLUMN_BUILDERS = {
+    'geo_logic': lambda df: geo_logic_column(
+        df['r_country'] if 'r_country' in df else [None] * len(df),
+        df['b_country'] if 'b_country' in df else [None] * len(df),
+    ),
+}
+
+DISPLAY_COLUMNS = list(DISPLAY_COLUMN_SPECS) + list(FRAME_COLUMN_BUILDERS)
+
+
+def _derive_categorical(df, columns, func):
+    """Apply func once per distinct combination of columns and broadcast it"""
+    combined = np.zeros(len(df), dtype=np.int64)
+    column_uniques = []
+    for column in columns:
+        if column in df:
+            codes, uniques = pd.factorize(df[column], use_na_sentinel=False)
+        else:
+            codes, uniques = np.zeros(len(df), dtype=np.int64), np.array([None], dtype=object)
+        combined = combined * len(uniques) + codes
+        column_uniques.append((codes, uniques))
+
+    combo_codes, combos = pd.factorize(combined)
+
+    # Recover one representative row per combination to decode its inputs
+    first_rows = np.zeros(len(combos), dtype=np.int64)
+    first_rows[combo_codes[::-1]] = np.arange(len(df))[::-1]
+    labels = [
+        func(*(uniques[codes[row]] for codes, uniques in column_uniques))
+        for row in first_rows
+    ]
+
+    label_codes, categories = pd.factorize(np.array(labels, dtype=object))
+    return pd.Categorical.from_codes(label_codes[combo_codes], categories=categories)
+
+
+def build_display_columns(df):
+    """Compute every display string and compatibility label as categoricals"""
+    columns = {
+        name: _derive_categorical(df, columns, func)
+        for name, (columns, func) in DISPLAY_COLUMN_SPECS.items()
+    }
+    for name, build in FRAME_COLUMN_BUILDERS.items():
+        columns[name] = build(df)
+    return pd.DataFrame(columns, index=df.index)
+
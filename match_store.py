@@ -0,0 +1,612 @@
+"""
+Columnar match store for the Biobank Viewer
+Compiles the enriched pair CSV into Parquet and reads it back with
+column projection and predicate pushdown. The filtered view columns are
+also written, together with the precomputed display columns, to an
+uncompressed Arrow IPC file that every app worker memory-maps read-only,
+so pages are shared through the OS page cache.
+
+The source is either the enriched pair CSV or a directory of Parquet
+parts written by the sharded LeadScore pipeline (lead_score.py); when the
+parts directory exists it takes precedence and is read as one dataset.
+
+Usage:
+    python match_store.py                       # convert data/pair_scores_enriched.csv
+    python match_store.py --csv in.csv --store out.parquet
+    python match_store.py --parts data/pair_scores_parts
+"""
+
+import argparse
+import csv
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from match_display import NOT_SPECIFIED, build_display_columns
+
+logger = logging.getLogger(__name__)
+
+MATCH_CSV_PATH = 'data/pair_scores_enriched.csv'
+MATCH_PARTS_DIR = 'data/pair_scores_parts'
+MATCH_STORE_PATH = 'data/pair_scores_enriched.parquet'
+MATCH_TABLE_PATH = 'data/pair_scores_enriched.arrow'
+
+# Incremental changes: CSV/Parquet files of upserted or deleted pairs
+DELTA_DIR = 'data/pair_scores_delta'
+DELTA_OP_COLUMN = 'delta_op'
+DELTA_OPS = ['upsert', 'delete']
+
+# Pairs below this disease score are never shown
+MIN_DISEASE_SCORE = 2.0
+
+# Columns the biobank/request views and the scoring breakdown read
+VIEW_COLUMNS = [
+    'biobank_name', 'post_title', 'LeadScore',
+    's_disease', 's_sample_type', 's_sample_format',
+    'r_disease', 'r_sample_type', 'r_sample_format',
+    'r_country', 'r_collaboration', 'r_prospective',
+    'b_disease', 'b_category', 'b_sample_type', 'b_sample_format',
+    'b_country', 'b_collaboration', 'b_prospective',
+    'biobank_specialty', 'disease_matched_category',
+]
+
+# Long free-text columns only needed when building an AI prompt
+DETAIL_COLUMNS = [
+    'r_post_content', 'r_no_cases', 'r_data_required',
+    'r_inclusion_criteria', 'r_exclusion_criteria',
+    'b_post_content', 'b_clinical_information',
+    'b_research_services', 'b_certifications',
+]
+
+# Row number of each view row in the Parquet store, for reading its details
+STORE_ROW_COLUMN = 'store_row'
+
+# Numeric score columns; everything else is kept as text
+SCORE_COLUMNS = ['LeadScore', 's_disease', 's_sample_type', 's_sample_format']
+
+# LeadScore histogram buckets in the entity summary: [0, 1), [1, 2), ... [9, 10]
+SCORE_BUCKETS = 10
+
+# Integer-valued sample scores (0-2) fit in int8; the others become float32
+SMALL_SCORE_COLUMNS = ['s_sample_type', 's_sample_format']
+
+# Bump when the layout of the Arrow view table changes so stale files rebuild
+MATCH_TABLE_VERSION = '7'
+
+# Small row groups keep min/max statistics selective for the s_disease filter
+ROW_GROUP_SIZE = 256 * 1024
+
+
+def convert_csv_to_store(csv_path=MATCH_CSV_PATH, store_path=MATCH_STORE_PATH):
+    """Stream the pair CSV into a Parquet file, one record batch at a time"""
+    # Per-process temp name: several workers may convert at the same time
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+
+    # Pin column types up front: per-block inference breaks on long files
+    # whose free-text columns look numeric in the first block
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        header = next(csv.reader(f))
+    column_types = {
+        name: pa.float64() if name in SCORE_COLUMNS else pa.string()
+        for name in header
+    }
+
+    reader = pa_csv.open_csv(
+        csv_path,
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+    )
+    writer = None
+    rows = 0
+
+    try:
+        for batch in reader:
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, batch.schema, compression='zstd')
+            writer.write_table(pa.Table.from_batches([batch]), row_group_size=ROW_GROUP_SIZE)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    # Replace atomically so running apps never see a half-written store
+    os.replace(tmp_path, store_path)
+    return rows
+
+
+def convert_parts_to_store(parts_dir=MATCH_PARTS_DIR, store_path=MATCH_STORE_PATH):
+    """Stream a directory of scored Parquet parts into the Parquet store"""
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+    dataset = ds.dataset(parts_dir, format='parquet')
+    rows = 0
+
+    with pq.ParquetWriter(tmp_path, dataset.schema, compression='zstd') as writer:
+        for batch in dataset.to_batches():
+            writer.write_table(pa.Table.from_batches([batch]), row_group_size=ROW_GROUP_SIZE)
+            rows += batch.num_rows
+
+    os.replace(tmp_path, store_path)
+    return rows
+
+
+def source_path(csv_path=MATCH_CSV_PATH, parts_dir=MATCH_PARTS_DIR):
+    """The pair source in use: the parts directory if present, else the CSV"""
+    return parts_dir if parts_dir and os.path.isdir(parts_dir) else csv_path
+
+
+def store_columns(store_path=MATCH_STORE_PATH):
+    """Return the column names present in the store"""
+    return pq.read_schema(store_path).names
+
+
+def read_match_table(columns=None, store_path=MATCH_STORE_PATH, min_disease_score=MIN_DISEASE_SCORE,
+                     row_numbers=False):
+    """Read the relevant pairs as an Arrow table, projecting only the requested columns
+
+    With row_numbers each row also gets its position in the store as a
+    STORE_ROW_COLUMN column.
+    """
+    available = store_columns(store_path)
+    if columns is not None:
+        columns = [c for c in columns if c in available]
+
+    if not row_numbers:
+        return pq.read_table(
+            store_path,
+            columns=columns,
+            filters=[('s_disease', '>=', min_disease_score)],
+        )
+
+    # Row group by row group, so each row's store position is known; groups
+    # whose s_disease statistics rule them out are skipped as before
+    parquet = pq.ParquetFile(store_path)
+    columns = columns if columns is not None else available
+    disease_field = parquet.schema_arrow.get_field_index('s_disease')
+    tables = []
+    start = 0
+    for i in range(parquet.num_row_groups):
+        num_rows = parquet.metadata.row_group(i).num_rows
+        stats = parquet.metadata.row_group(i).column(disease_field).statistics
+        if stats is None or not stats.has_min_max or stats.max >= min_disease_score:
+            group = parquet.read_row_group(i, columns=list(dict.fromkeys(columns + ['s_disease'])))
+            group = group.append_column(
+                STORE_ROW_COLUMN, pa.array(np.arange(start, start + num_rows, dtype=np.uint32))
+            )
+            group = group.filter(pc.greater_equal(group['s_disease'], min_disease_score))
+            tables.append(group.select(columns + [STORE_ROW_COLUMN]))
+        start += num_rows
+    if not tables:
+        schema = pa.schema([parquet.schema_arrow.field(c) for c in columns] + [(STORE_ROW_COLUMN, pa.uint32())])
+        return schema.empty_table()
+    return pa.concat_tables(tables)
+
+
+def read_match_store(columns=None, store_path=MATCH_STORE_PATH, min_disease_score=MIN_DISEASE_SCORE):
+    """Read the relevant pairs into a DataFrame"""
+    return read_match_table(columns, store_path, min_disease_score).to_pandas()
+
+
+def read_match_details(biobank_name, request_title, store_path=MATCH_STORE_PATH, store_row=None):
+    """Fetch the free-text detail columns for a single pair
+
+    With its store_row only the row group holding that row is read; without
+    one, or when the store was rewritten since, the pair is searched for.
+    """
+    available = store_columns(store_path)
+    columns = [c for c in DETAIL_COLUMNS if c in available]
+    if not columns:
+        return {}
+
+    if store_row is not None:
+        parquet = pq.ParquetFile(store_path)
+        start = 0
+        for i in range(parquet.num_row_groups):
+            num_rows = parquet.metadata.row_group(i).num_rows
+            if store_row < start + num_rows:
+                row = parquet.read_row_group(i, columns=['biobank_name', 'post_title'] + columns)
+                row = row.slice(store_row - start, 1).to_pylist()[0]
+                if (row.pop('biobank_name'), row.pop('post_title')) == (biobank_name, request_title):
+                    return row
+                break
+            start += num_rows
+
+    table = pq.read_table(
+        store_path,
+        columns=columns,
+        filters=[
+            ('biobank_name', '==', biobank_name),
+            ('post_title', '==', request_title),
+        ],
+    )
+    if table.num_rows == 0:
+        return {}
+    return table.slice(0, 1).to_pylist()[0]
+
+
+def read_bulk_match_details(min_lead_score, store_path=MATCH_STORE_PATH):
+    """Free-text detail columns of every pair at or above a LeadScore, keyed by pair"""
+    available = store_columns(store_path)
+    columns = [c for c in DETAIL_COLUMNS if c in available]
+    table = pq.read_table(
+        store_path,
+        columns=['biobank_name', 'post_title'] + columns,
+        filters=[('LeadScore', '>=', min_lead_score)],
+    )
+
+    # Same shape as read_match_details: the first stored row of each pair
+    details = {}
+    for row in table.to_pylist():
+        key = (row.pop('biobank_name'), row.pop('post_title'))
+        details.setdefault(key, row)
+    return details
+
+
+def _object_frame_bytes(table):
+    """Estimate the footprint of the table as a plain read_csv DataFrame"""
+    # float64 / object pointer per cell, plus a separate Python str object
+    # (49 bytes of header + one byte per ASCII char) for every text cell
+    total = 0
+    for column in table.columns:
+        total += 8 * len(column)
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            non_null = len(column) - column.null_count
+            total += 49 * non_null + (pc.sum(pc.binary_length(column)).as_py() or 0)
+    return total
+
+
+def apply_match_schema(table):
+    """Dictionary-encode text columns and downcast the score columns"""
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if name in SMALL_SCORE_COLUMNS and column.null_count == 0 and pc.all(
+            pc.equal(pc.floor(column), column)
+        ).as_py():
+            column = column.cast(pa.int8())
+        elif name in SCORE_COLUMNS:
+            column = column.cast(pa.float32())
+        elif pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            # Entity attributes repeat across millions of pairs: store each
+            # distinct value once and keep small integer codes per row. A null
+            # makes pandas rewrite the codes (as -1), so missing text takes
+            # the value the display already shows for it.
+            column = column.fill_null('' if name == 'disease_matched_category' else NOT_SPECIFIED)
+            column = column.dictionary_encode()
+        columns.append(column)
+    return pa.table(columns, names=table.column_names)
+
+
+def _string_types_mapper(arrow_type):
+    """Keep Arrow strings Arrow-backed so pandas wraps them without copying"""
+    if arrow_type in (pa.string(), pa.large_string()):
+        return pd.StringDtype('pyarrow')
+    return None
+
+
+def add_display_columns(table):
+    """Append the derived display and compatibility columns to a view table"""
+    display = build_display_columns(table.to_pandas(types_mapper=_string_types_mapper))
+    for name in display.columns:
+        table = table.append_column(name, pa.array(display[name]))
+    return table
+
+
+def _pandas_index_type(num_categories):
+    """Dictionary index type of the width pandas picks for categorical codes"""
+    # Mirrors pandas' coerce_indexer_dtype; any other width is converted,
+    # i.e. copied into private memory, in every process that maps the file
+    if num_categories < np.iinfo(np.int8).max:
+        return pa.int8()
+    if num_categories < np.iinfo(np.int16).max:
+        return pa.int16()
+    return pa.int32()
+
+
+def narrow_dictionary_indices(table):
+    """Cast each single-chunk dictionary column's indices to the pandas codes width"""
+    columns = []
+    for column in table.columns:
+        if pa.types.is_dictionary(column.type) and column.num_chunks == 1:
+            index_type = _pandas_index_type(len(column.chunk(0).dictionary))
+            if column.type.index_type != index_type:
+                column = column.cast(pa.dictionary(index_type, column.type.value_type))
+        columns.append(column)
+    return pa.table(columns, schema=pa.schema(
+        [field.with_type(column.type) for field, column in zip(table.schema, columns)],
+        metadata=table.schema.metadata,
+    ))
+
+
+def write_match_table(table, table_path=MATCH_TABLE_PATH):
+    """Write an Arrow table as an uncompressed IPC file suitable for mmap"""
+    # Per-process temp name: several workers may rebuild at the same time
+    tmp_path = f"{table_path}.{os.getpid()}.tmp"
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'match_table_version'] = MATCH_TABLE_VERSION.encode()
+    table = narrow_dictionary_indices(table.combine_chunks()).replace_schema_metadata(metadata)
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, table_path)
+
+
+def _is_stale(path, source_path):
+    """True when path is missing or older than an existing source file"""
+    if not os.path.exists(path):
+        return True
+    return os.path.exists(source_path) and os.path.getmtime(source_path) > os.path.getmtime(path)
+
+
+def _table_version(table_path):
+    """Layout version recorded in an Arrow view table"""
+    with pa.memory_map(table_path, 'r') as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return metadata.get(b'match_table_version', b'').decode()
+
+
+def build_view_table(store_path=MATCH_STORE_PATH):
+    """Read the view columns from the store, apply the schema and add the display columns"""
+    table = read_match_table(VIEW_COLUMNS, store_path, row_numbers=True)
+    object_bytes = _object_frame_bytes(table.drop_columns([STORE_ROW_COLUMN]))
+    table = add_display_columns(apply_match_schema(table))
+    logger.info(
+        "Match view table: %s rows, %.1f MB as object dtypes -> %.1f MB with schema",
+        f"{table.num_rows:,}", object_bytes / 1e6, table.nbytes / 1e6,
+    )
+    return table.replace_schema_metadata({'object_frame_bytes': str(object_bytes)})
+
+
+def ensure_match_table(csv_path=MATCH_CSV_PATH, store_path=MATCH_STORE_PATH, table_path=MATCH_TABLE_PATH,
+                       parts_dir=MATCH_PARTS_DIR):
+    """Compile CSV or parts -> Parquet -> Arrow IPC as needed and return the IPC path"""
+    source = source_path(csv_path, parts_dir)
+    if _is_stale(store_path, source):
+        if not os.path.exists(source):
+            raise FileNotFoundError(source)
+        if source == parts_dir:
+            convert_parts_to_store(parts_dir, store_path)
+        else:
+            convert_csv_to_store(csv_path, store_path)
+
+    if _is_stale(table_path, store_path) or _table_version(table_path) != MATCH_TABLE_VERSION:
+        write_match_table(build_view_table(store_path), table_path)
+
+    return table_path
+
+
+def _copied_codes(table, df):
+    """Categorical columns whose codes do not share the mapped index buffer"""
+    copied = []
+    for name in table.column_names:
+        column = table.column(name)
+        if not pa.types.is_dictionary(column.type):
+            continue
+        if column.num_chunks != 1:
+            copied.append(name)
+            continue
+        indices = column.chunk(0).indices
+        mapped = np.frombuffer(indices.buffers()[1], dtype=indices.type.to_pandas_dtype())
+        if not np.shares_memory(df[name].array.codes, mapped):
+            copied.append(name)
+    return copied
+
+
+def open_match_table(table_path=MATCH_TABLE_PATH):
+    """Memory-map the IPC file and build a DataFrame of zero-copy views over it"""
+    source = pa.memory_map(table_path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    # split_blocks stops pandas consolidating numeric columns into new arrays,
+    # so numeric columns are read-only views backed by the mapped file.
+    # Dictionary columns arrive as pandas categoricals whose codes view the
+    # mapped indices (written at pandas' width); only their categories are
+    # per-process objects.
+    df = table.to_pandas(split_blocks=True, types_mapper=_string_types_mapper)
+    copied = _copied_codes(table, df)
+    if copied:
+        logger.warning("Categorical codes copied out of the mapped table for: %s", ", ".join(copied))
+
+    metadata = table.schema.metadata or {}
+    df.attrs['object_frame_bytes'] = int(metadata.get(b'object_frame_bytes', 0))
+    df.attrs['frame_bytes'] = int(df.memory_usage(deep=True).sum())
+    logger.info(
+        "Loaded %s matches: %.1f MB in memory (%.1f MB as object dtypes)",
+        f"{len(df):,}", df.attrs['frame_bytes'] / 1e6, df.attrs['object_frame_bytes'] / 1e6,
+    )
+    return df
+
+
+def _factorize_sorted(values):
+    """Factorize values with the uniques in lexical order (categoricals included)"""
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    order = np.argsort(uniques, kind='stable')
+    remap = np.empty(len(order), dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    codes = np.where(codes >= 0, remap[np.maximum(codes, 0)], -1)
+    return codes, uniques[order]
+
+
+def build_match_index(df, key):
+    """Map each value of key to its row offsets, best LeadScore first"""
+    # Sorted factorization keeps the dict in display order for the selectors
+    codes, uniques = _factorize_sorted(df[key])
+    scores = df['LeadScore'].to_numpy()
+
+    # lexsort is stable: within an entity, equal scores keep file order
+    valid = np.flatnonzero(codes >= 0)
+    order = valid[np.lexsort((-scores[valid], codes[valid]))]
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(codes[valid], minlength=len(uniques)))))
+
+    return {
+        value: order[bounds[i]:bounds[i + 1]]
+        for i, value in enumerate(uniques)
+    }
+
+
+def top_k_positions(scores, k, min_score=None):
+    """Offsets of the k highest scores, highest first; ties keep input order"""
+    if min_score is None:
+        candidates = np.arange(len(scores))
+    else:
+        candidates = np.flatnonzero(scores >= min_score)
+
+    if len(candidates) > k > 0:
+        # argpartition finds the kth best score in linear time; everything at
+        # or above it survives so boundary ties are settled by position below
+        candidate_scores = scores[candidates]
+        kth_score = candidate_scores[np.argpartition(-candidate_scores, k - 1)[k - 1]]
+        candidates = candidates[candidate_scores >= kth_score]
+
+    ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+    return ranked[:k]
+
+
+def list_delta_files(delta_dir=DELTA_DIR):
+    """Pending delta files in application order (by file name)"""
+    if not os.path.isdir(delta_dir):
+        return []
+    return [
+        os.path.join(delta_dir, name)
+        for name in sorted(os.listdir(delta_dir))
+        if name.endswith(('.csv', '.parquet'))
+    ]
+
+
+def read_delta_file(path):
+    """Read a delta of upserted/deleted pairs keyed by (biobank_name, post_title)
+
+    Upserts replace whole rows, so they must carry every view column and
+    all four scores; deletes only need the key columns.
+    """
+    if path.endswith('.parquet'):
+        delta = pd.read_parquet(path)
+    else:
+        delta = pd.read_csv(path, dtype=str)
+        for column in SCORE_COLUMNS:
+            if column in delta:
+                delta[column] = pd.to_numeric(delta[column])
+
+    return normalize_delta(delta, path)
+
+
+def normalize_delta(delta, name):
+    """Validate a delta frame and default its operations to upsert
+
+    Used for delta files and in-memory frames alike; returns a copy.
+    """
+    missing = {'biobank_name', 'post_title'} - set(delta.columns)
+    if missing:
+        raise ValueError(f"Delta {name} is missing key columns: {sorted(missing)}")
+
+    delta = delta.copy()
+    if DELTA_OP_COLUMN not in delta:
+        delta[DELTA_OP_COLUMN] = 'upsert'
+    delta[DELTA_OP_COLUMN] = delta[DELTA_OP_COLUMN].fillna('upsert').str.lower()
+    unknown = set(delta[DELTA_OP_COLUMN]) - set(DELTA_OPS)
+    if unknown:
+        raise ValueError(f"Delta {name} has unknown {DELTA_OP_COLUMN} values: {sorted(unknown)}")
+
+    check_delta_upserts(delta, name)
+    return delta
+
+
+def check_delta_upserts(delta, name):
+    """Reject upserts that would replace stored rows with incomplete ones"""
+    upserts = delta[DELTA_OP_COLUMN] == 'upsert'
+    if not upserts.any():
+        return
+    missing = set(VIEW_COLUMNS) - set(delta.columns)
+    if missing:
+        raise ValueError(f"Delta {name} upserts are missing view columns: {sorted(missing)}")
+    unscored = int(delta.loc[upserts, SCORE_COLUMNS].isna().any(axis=1).sum())
+    if unscored:
+        raise ValueError(f"Delta {name} has {unscored} upserts with missing scores")
+
+
+def combine_deltas(deltas):
+    """Concatenate deltas in order, keeping only the last operation per pair"""
+    if not deltas:
+        return pd.DataFrame(columns=['biobank_name', 'post_title', DELTA_OP_COLUMN])
+    combined = pd.concat(deltas, ignore_index=True)
+    return combined.drop_duplicates(['biobank_name', 'post_title'], keep='last').reset_index(drop=True)
+
+
+def compact_store(delta, store_path=MATCH_STORE_PATH):
+    """Rewrite the Parquet store with a combined delta merged in"""
+    table = pq.read_table(store_path)
+
+    # Drop every stored row whose pair is touched by the delta
+    separator = '\x1f'
+    keys = pc.binary_join_element_wise(table['biobank_name'], table['post_title'], separator)
+    delta_keys = pa.array((delta['biobank_name'] + separator + delta['post_title']).tolist(), type=pa.string())
+    keep = pc.fill_null(pc.invert(pc.is_in(keys, value_set=delta_keys)), True)
+    table = table.filter(keep)
+
+    # Append the upserts in the store's schema; absent columns become null
+    upserts = delta[delta[DELTA_OP_COLUMN] == 'upsert'].reindex(columns=table.column_names)
+    upserts = upserts.astype(object).where(upserts.notna(), None)
+    table = pa.concat_tables([
+        table,
+        pa.Table.from_pandas(upserts, schema=table.schema, preserve_index=False),
+    ])
+
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE, compression='zstd')
+    os.replace(tmp_path, store_path)
+    return table.num_rows
+
+
+def build_entity_summary(df, key):
+    """One row per entity with match counts, mean LeadScore and a score histogram"""
+    codes, uniques = _factorize_sorted(df[key])
+    scores = df['LeadScore'].to_numpy(dtype=np.float64)
+    valid = codes >= 0
+    codes, scores = codes[valid], scores[valid]
+    n = len(uniques)
+
+    matches = np.bincount(codes, minlength=n)
+    top_score = np.zeros(n)
+    np.maximum.at(top_score, codes, scores)
+
+    summary = pd.DataFrame({
+        'matches': matches,
+        'avg_score': np.bincount(codes, weights=scores, minlength=n) / np.maximum(matches, 1),
+        'top_score': top_score,
+        'high_matches': np.bincount(codes[scores >= 7], minlength=n),
+        'near_perfect': np.bincount(codes[scores >= 9.5], minlength=n),
+    }, index=pd.Index(uniques, name=key))
+
+    buckets = np.clip(np.floor(scores).astype(int), 0, SCORE_BUCKETS - 1)
+    histogram = np.zeros((n, SCORE_BUCKETS), dtype=np.int64)
+    np.add.at(histogram, (codes, buckets), 1)
+    for b in range(SCORE_BUCKETS):
+        summary[f'score_{b}_{b + 1}'] = histogram[:, b]
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the enriched pair CSV into a Parquet match store")
+    parser.add_argument('--csv', default=MATCH_CSV_PATH, help="Source pair_scores_enriched.csv")
+    parser.add_argument('--parts', default=MATCH_PARTS_DIR, help="Source directory of scored Parquet parts")
+    parser.add_argument('--store', default=MATCH_STORE_PATH, help="Destination Parquet file")
+    parser.add_argument('--table', default=MATCH_TABLE_PATH, help="Destination memory-mappable Arrow file")
+    args = parser.parse_args()
+
+    if source_path(args.csv, args.parts) == args.parts:
+        rows = convert_parts_to_store(args.parts, args.store)
+    else:
+        rows = convert_csv_to_store(args.csv, args.store)
+    print(f"Wrote {rows:,} rows to {args.store}")
+
+    write_match_table(build_view_table(args.store), args.table)
+    print(f"Wrote view table to {args.table}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Retrieval over the biobanking playbook for AI prompts
+The playbook (config/knowledge/Playbook_ALL.md) is split at its ## / ###
+headings and indexed with BM25 once per process. For each match a query is
+built from the countries (with their region and regulatory blocs),
+collaboration terms, prospective needs and sample types involved, and the
+best-scoring sections that fit a token budget are returned in document
+order, after the playbook's global instruction block.
+"""
+
+import math
+import re
+from collections import Counter
+
+from ai_prompts import KNOWLEDGE_BASE_PATH, KNOWLEDGE_TOKEN_BUDGET, count_tokens, read_knowledge_base, truncate_tokens
+from match_display import COUNTRY_REGIONS, NOT_SPECIFIED
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Navigation, file-map and bibliography sections carry no guidance
+SKIPPED_SECTION = re.compile(
+    r'^(table of contents|references|citation note|file structure|updating the playbook)|\.md$',
+    re.IGNORECASE,
+)
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it', 'of', 'on',
+    'or', 'that', 'the', 'this', 'to', 'with', 'not', 'specified',
+}
+
+# Extra query words for labels whose guidance uses different vocabulary
+BLOC_QUERY_TERMS = {
+    'EU': "European Union GDPR",
+    'EEA': "GDPR",
+    'GDPR adequacy': "GDPR adequacy transfer",
+    'US-Canada': "",
+}
+COLLABORATION_QUERY_TERMS = {
+    'fee-for-service': "fee-for-service commercial pricing tariffs",
+    'collaboration & co-publication': "collaboration co-publication authorship",
+    'open to discussion': "collaboration terms",
+    'it depends': "collaboration terms",
+}
+
+
+def tokenize(text):
+    """Lower-case word tokens without stopwords"""
+    return [t for t in re.findall(r'[a-z0-9]+', text.lower()) if t not in STOPWORDS]
+
+
+def split_sections(text):
+    """Preamble plus (heading path, section text) for every ## / ### heading"""
+    preamble = []
+    sections = []
+    part = parent = parent_path = path = None
+    lines = []
+
+    def flush():
+        if path is not None:
+            sections.append((path, "\n".join(lines).strip().rstrip('-').strip()))
+
+    for line in text.splitlines():
+        match = re.match(r'^(#{2,3}) +(.*\S)', line)
+        if not match:
+            (lines if path is not None else preamble).append(line)
+            continue
+        flush()
+        level, title = match.groups()
+        if level == '##':
+            if title.lower().startswith('part '):
+                part = title
+            parent = heading = title
+            path = parent_path = title if part is None or title == part else f"{part} > {title}"
+        else:
+            heading = f"{parent} > {title}" if parent else title
+            path = f"{parent_path} > {title}" if parent_path else title
+        # The prompt gets a short heading; the full path identifies the section
+        lines = [f"{level} {heading}"]
+    flush()
+
+    preamble = "\n".join(line for line in preamble if not line.startswith('# ')).strip().strip('-').strip()
+    return preamble, sections
+
+
+class PlaybookIndex:
+    """BM25 index over playbook sections"""
+
+    def __init__(self, text, token_budget=KNOWLEDGE_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.preamble, sections = split_sections(text)
+        self.sections = [(title, body) for title, body in sections
+                         if body.count('\n') > 0 and not SKIPPED_SECTION.search(title.split(' > ')[-1])]
+
+        self.term_counts = [Counter(tokenize(body)) for _, body in self.sections]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        n = len(self.sections)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    @classmethod
+    def from_file(cls, path=KNOWLEDGE_BASE_PATH, token_budget=KNOWLEDGE_TOKEN_BUDGET):
+        """Index the playbook file (empty index if it is missing)"""
+        return cls(read_knowledge_base(path), token_budget)
+
+    def scores(self, query):
+        """BM25 score of every section for a query string"""
+        terms = tokenize(query)
+        results = []
+        for counts, length in zip(self.term_counts, self.lengths):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self.average_length or 1))
+            for term in terms:
+                tf = counts.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            results.append(score)
+        return results
+
+    def search(self, query, token_budget=None):
+        """Best-scoring sections that fit the budget, in document order"""
+        budget = self.token_budget if token_budget is None else token_budget
+
+        scores = self.scores(query)
+        ranked = sorted((i for i, score in enumerate(scores) if score > 0), key=lambda i: -scores[i])
+        chosen = []
+        for i in ranked:
+            cost = count_tokens(self.sections[i][1])
+            if cost <= budget:
+                chosen.append(i)
+                budget -= cost
+        return [self.sections[i] for i in sorted(chosen)]
+
+    def context(self, query, token_budget=None):
+        """Preamble plus the selected sections as one prompt block, within the budget"""
+        budget = self.token_budget if token_budget is None else token_budget
+        # The preamble comes first and is cut short when it alone is over budget
+        preamble = truncate_tokens(self.preamble, budget)
+        parts = [preamble] if preamble else []
+        parts += [body for _, body in self.search(query, budget - count_tokens(preamble))]
+        return "\n\n".join(parts)
+
+    def context_for(self, match, token_budget=None):
+        """Playbook context relevant to one match"""
+        return self.context(match_query(match), token_budget)
+
+
+def _value(match, column):
+    value = match.get(column)
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    value = str(value)
+    return '' if value == NOT_SPECIFIED else value
+
+
+def match_query(match):
+    """Retrieval query from a match's countries, terms and sample types"""
+    terms = []
+    countries = [_value(match, 'r_country'), _value(match, 'b_country')]
+    for country in countries:
+        if not country:
+            continue
+        terms.append(country)
+        if country in COUNTRY_REGIONS.index:
+            info = COUNTRY_REGIONS.loc[country]
+            terms.append(info['region'])
+            terms += [BLOC_QUERY_TERMS.get(bloc, '') for bloc in BLOC_QUERY_TERMS if info.get(bloc)]
+    canonical = [COUNTRY_REGIONS['canonical'].get(country, country) for country in countries]
+    if all(countries) and canonical[0] != canonical[1]:
+        terms.append("cross-border transfer MTA")
+
+    r_collaboration = _value(match, 'r_collaboration')
+    terms.append(COLLABORATION_QUERY_TERMS.get(r_collaboration.lower(), r_collaboration))
+    if _value(match, 'b_collaboration') in ('Yes', 'Sometimes'):
+        terms.append("collaboration required")
+    if _value(match, 'r_prospective') == 'Yes':
+        terms.append("prospective collection consent")
+
+    for column in ('r_sample_type', 'b_sample_type', 'r_sample_format'):
+        terms.append(_value(match, column).replace(',', ' '))
+    # Each word once, so a shared country does not outweigh everything else
+    words = dict.fromkeys(word for term in terms for word in term.split())
+    return " ".join(words)